@@ -1,3 +1,8 @@
+import argparse
+import random
+import sys
+import time
+
 input = """\
 ....#
 #..#.
@@ -51,17 +56,6 @@ def format_layout(layout):
 def print_layout(layout):
     print(format_layout(layout))
 
-layouts = [layout]
-
-while True:
-    # print_layout(layout)
-    layout = next_layout(layout)
-    if layout in layouts:
-        print_layout(layout)
-        print(len(layouts))
-        break 
-    layouts.append(layout)
-
 def biodiversity(layout):
     cells = [
         cell
@@ -76,4 +70,235 @@ def biodiversity(layout):
 
     return biodiversity
 
-print(biodiversity(layout))
+# The same rules on a bitboard: bit 5 * y + x is set when there is a bug
+# at (x, y), so a board is its own biodiversity rating.
+FULL = (1 << 25) - 1
+NOT_LEFT = sum(1 << (5 * y + x) for y in range(5) for x in range(1, 5))
+NOT_RIGHT = sum(1 << (5 * y + x) for y in range(5) for x in range(4))
+
+def parse_board(input):
+    return sum(
+        1 << index
+        for index, cell in enumerate(input.replace("\n", ""))
+        if cell == "#"
+    )
+
+def format_board(board):
+    return "".join(
+        ("#" if board >> index & 1 else ".") + ("\n" if index % 5 == 4 else "")
+        for index in range(25)
+    )
+
+# Counts each cell's neighbours with bitwise adders over the four boards
+# shifted towards it, one bit per cell, so a step is a few shifts and
+# masks whatever the number of bugs.
+def step(board):
+    above = board << 5 & FULL
+    below = board >> 5
+    left = board << 1 & NOT_LEFT
+    right = board >> 1 & NOT_RIGHT
+
+    return next_board(board, above, below, left, right)
+
+# The cells that will have bugs, given four boards with the bit for each
+# cell set when its neighbour that way has a bug.
+def next_board(board, above, below, left, right):
+    odd = above ^ below ^ left ^ right
+    two_or_more = (above & below) | (left & right) | ((above ^ below) & (left ^ right))
+    four = above & below & left & right
+    one = odd & ~two_or_more
+    two = two_or_more & ~odd & ~four
+
+    return (board & one) | (~board & (one | two) & FULL)
+
+# The first board to appear twice, and how many came before it repeated.
+def first_repeat(board):
+    seen = set()
+    while board not in seen:
+        seen.add(board)
+        board = step(board)
+    return board, len(seen)
+
+def layout_of(board):
+    return [list(row) for row in format_board(board).splitlines()]
+
+def test_step_matches_next_layout():
+    rng = random.Random(0)
+    for board in [0, FULL] + [rng.getrandbits(25) for _ in range(2000)]:
+        layout = layout_of(board)
+        assert biodiversity(layout) == board
+        assert step(board) == biodiversity(next_layout(layout))
+
+def test_first_repeat_of_example():
+    board, count = first_repeat(parse_board(input))
+    assert board == 2129920
+    assert format_board(board) == format_layout(layout_of(board))
+
+# In the recursive variant the centre is a whole grid one level in, and
+# the grid is itself the centre of one a level out. Levels are boards in
+# a dict keyed by depth, deeper levels further in, holding only levels
+# with bugs. Each cell's neighbours are precomputed as three masks: on
+# its own level, on the level out and on the level in.
+CENTRE = 12
+TOP_ROW = 0b11111
+BOTTOM_ROW = TOP_ROW << 20
+LEFT_COLUMN = sum(1 << (5 * y) for y in range(5))
+RIGHT_COLUMN = LEFT_COLUMN << 4
+
+def recursive_neighbour_masks(index):
+    x, y = index % 5, index // 5
+    same = outer = inner = 0
+    for dx, dy in ([-1, 0], [1, 0], [0, -1], [0, 1]):
+        x1, y1 = x + dx, y + dy
+        if not (0 <= x1 < 5 and 0 <= y1 < 5):
+            # The cell next to the centre on that side, one level out.
+            outer |= 1 << (5 * (2 + dy) + 2 + dx)
+        elif (x1, y1) == (2, 2):
+            # The whole side of the level in that faces this cell.
+            inner |= {
+                (1, 0): LEFT_COLUMN,
+                (-1, 0): RIGHT_COLUMN,
+                (0, 1): TOP_ROW,
+                (0, -1): BOTTOM_ROW,
+            }[dx, dy]
+        else:
+            same |= 1 << (5 * y1 + x1)
+    return same, outer, inner
+
+NEIGHBOUR_MASKS = [
+    (index, recursive_neighbour_masks(index))
+    for index in range(25)
+]
+
+# Only the four cells around the centre can have more than one
+# neighbour in a direction, so only they are counted from the table.
+# Every other cell has at most one each way, on its own level or in the
+# single cell next to the centre a level out, and goes through the same
+# adders as a flat step.
+AROUND_CENTRE = [
+    (index, masks)
+    for index, masks in NEIGHBOUR_MASKS
+    if masks[2]
+]
+NOT_AROUND_CENTRE = FULL & ~sum(1 << index for index in (7, 11, CENTRE, 13, 17))
+
+def recursive_step(levels):
+    if not levels:
+        return {}
+
+    result = {}
+    for depth in range(min(levels) - 1, max(levels) + 2):
+        board = levels.get(depth, 0)
+        outer = levels.get(depth - 1, 0)
+        inner = levels.get(depth + 1, 0)
+        if not (board or outer or inner):
+            continue
+
+        above = board << 5 & FULL | (TOP_ROW if outer >> 7 & 1 else 0)
+        below = board >> 5 | (BOTTOM_ROW if outer >> 17 & 1 else 0)
+        left = board << 1 & NOT_LEFT | (LEFT_COLUMN if outer >> 11 & 1 else 0)
+        right = board >> 1 & NOT_RIGHT | (RIGHT_COLUMN if outer >> 13 & 1 else 0)
+        new_board = next_board(board, above, below, left, right) & NOT_AROUND_CENTRE
+
+        for index, (same, outer_mask, inner_mask) in AROUND_CENTRE:
+            count = (
+                (board & same).bit_count() +
+                (outer & outer_mask).bit_count() +
+                (inner & inner_mask).bit_count()
+            )
+            if count == 1 or (count == 2 and not board >> index & 1):
+                new_board |= 1 << index
+
+        if new_board:
+            result[depth] = new_board
+
+    return result
+
+# The same step one cell at a time from the full table, to check the
+# one above against.
+def recursive_step_by_cell(levels):
+    if not levels:
+        return {}
+
+    result = {}
+    for depth in range(min(levels) - 1, max(levels) + 2):
+        board = levels.get(depth, 0)
+        outer = levels.get(depth - 1, 0)
+        inner = levels.get(depth + 1, 0)
+
+        new_board = 0
+        for index, (same, outer_mask, inner_mask) in NEIGHBOUR_MASKS:
+            if index == CENTRE:
+                continue
+            count = (
+                (board & same).bit_count() +
+                (outer & outer_mask).bit_count() +
+                (inner & inner_mask).bit_count()
+            )
+            if count == 1 or (count == 2 and not board >> index & 1):
+                new_board |= 1 << index
+
+        if new_board:
+            result[depth] = new_board
+
+    return result
+
+def recursive_bugs(board, minutes):
+    levels = {0: board & ~(1 << CENTRE)} if board & ~(1 << CENTRE) else {}
+    for _ in range(minutes):
+        levels = recursive_step(levels)
+    return levels
+
+def test_recursive_step_matches_recursive_step_by_cell():
+    rng = random.Random(0)
+    for _ in range(500):
+        levels = {
+            depth: rng.getrandbits(25) & ~(1 << CENTRE)
+            for depth in range(rng.randint(-3, 0), rng.randint(0, 3) + 1)
+        }
+        levels = {depth: board for depth, board in levels.items() if board}
+        for _ in range(3):
+            stepped = recursive_step(levels)
+            assert stepped == recursive_step_by_cell(levels)
+            levels = stepped
+
+def test_recursive_bugs_of_example():
+    levels = recursive_bugs(parse_board(input), 10)
+    assert sum(board.bit_count() for board in levels.values()) == 99
+    assert len(levels) == 11
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--recursive",
+        action="store_true",
+        help="treat the centre as a grid within a grid",
+    )
+    parser.add_argument(
+        "--minutes",
+        type=int,
+        default=200,
+        help="minutes to run the recursive variant for",
+    )
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    start = time.perf_counter()
+
+    if args.recursive:
+        levels = recursive_bugs(parse_board(input), args.minutes)
+        print(sum(board.bit_count() for board in levels.values()))
+        print("%d levels" % len(levels), file=sys.stderr)
+        minutes = args.minutes
+    else:
+        board, count = first_repeat(parse_board(input))
+        print(format_board(board))
+        print(count)
+        print(board)
+        minutes = count
+
+    elapsed = time.perf_counter() - start
+    print("%d minutes in %.3fs, %.0f minutes/s" % (
+        minutes, elapsed, minutes / elapsed,
+    ), file=sys.stderr)
@@ -1,7 +1,77 @@
+import argparse
+import io
 import itertools
+import random
+import sys
+from array import array
 
 
-def solve(universe):
+def solve(universe, factor=2):
+    galaxies = find_galaxies(universe.splitlines())
+
+    return expanded_total_distance(galaxies, factor)
+
+
+# expanded_total_distance read straight from the lines of a universe, in
+# one pass and in memory proportional to its width. Rows arrive in order,
+# so the y sum is kept as they stream past, and x is summed at the end
+# from a count of galaxies in each column, which also shows which columns
+# are empty without sorting or keeping a single galaxy.
+def solve_stream(lines, factor=2):
+    column_counts = array("q")
+    total = 0
+    galaxies = 0
+    before = 0
+    empty_rows = 0
+
+    for y, line in enumerate(lines):
+        line = line.rstrip("\n")
+        if len(line) > len(column_counts):
+            column_counts.extend([0] * (len(line) - len(column_counts)))
+
+        row_count = 0
+        x = line.find("#")
+        while x >= 0:
+            column_counts[x] += 1
+            row_count += 1
+            x = line.find("#", x + 1)
+
+        if row_count == 0:
+            empty_rows += 1
+            continue
+
+        position = y + (factor - 1) * empty_rows
+        total += row_count * (position * galaxies - before)
+        galaxies += row_count
+        before += row_count * position
+
+    return total + counted_axis_distance(column_counts, factor)
+
+
+# The distance along one axis from the number of galaxies at each
+# position, where a position with none is empty.
+def counted_axis_distance(counts, factor):
+    total = 0
+    galaxies = 0
+    before = 0
+    empty = 0
+
+    for position, count in enumerate(counts):
+        if count == 0:
+            empty += 1
+            continue
+
+        position += (factor - 1) * empty
+        total += count * (position * galaxies - before)
+        galaxies += count
+        before += count * position
+
+    return total
+
+
+# The original solver, which builds the expanded universe cell by cell
+# and sums every pair, kept to check the fast one against.
+def solve_by_expanding(universe):
     expanded_universe = expand(universe)
 
     galaxies = find_galaxies(expanded_universe)
@@ -54,6 +124,39 @@ def total_distance(galaxies):
     )
 
 
+# total_distance in O(G log G) after every empty row and column is made
+# factor wide, without building the expanded universe. Manhattan distance
+# splits into an x and a y part, so each axis is summed on its own.
+def expanded_total_distance(galaxies, factor=2):
+    return (
+        expanded_axis_distance((x for x, y in galaxies), factor) +
+        expanded_axis_distance((y for x, y in galaxies), factor)
+    )
+
+
+# Walks the galaxies' positions on one axis in order. A galaxy's column
+# is occupied, so the empty columns before it are its position less the
+# number of distinct occupied columns before it. Once sorted, each
+# position is at least every one before it, so it adds position * i less
+# the sum of those i positions.
+def expanded_axis_distance(positions, factor):
+    total = 0
+    before = 0
+    occupied = -1
+    previous = None
+
+    for i, position in enumerate(sorted(positions)):
+        if position != previous:
+            occupied += 1
+            previous = position
+
+        position += (factor - 1) * (position - occupied)
+        total += position * i - before
+        before += position
+
+    return total
+
+
 def distance(left, right):
     (x1, y1) = left
     (x2, y2) = right
@@ -61,7 +164,7 @@ def distance(left, right):
     return abs(y2 - y1) + abs(x2 - x1)
 
 
-print(solve("""\
+EXAMPLE = """\
 ...#......
 .......#..
 #.........
@@ -71,4 +174,54 @@ print(solve("""\
 .........#
 ..........
 .......#..
-#...#....."""))
+#...#....."""
+
+
+def random_universe(rng, width, height, density=0.1):
+    return "\n".join(
+        "".join("#" if rng.random() < density else "." for _ in range(width))
+        for _ in range(height)
+    )
+
+
+def test_example():
+    assert solve(EXAMPLE) == 374
+    assert solve(EXAMPLE, 10) == 1030
+    assert solve(EXAMPLE, 100) == 8410
+
+
+def test_solve_matches_solve_by_expanding():
+    rng = random.Random(0)
+    for _ in range(200):
+        universe = random_universe(rng, rng.randint(1, 12), rng.randint(1, 12))
+        assert solve(universe) == solve_by_expanding(universe)
+
+
+def test_solve_stream_matches_solve():
+    rng = random.Random(1)
+    for _ in range(200):
+        universe = random_universe(rng, rng.randint(1, 12), rng.randint(1, 12))
+        for factor in (1, 2, 10, 1000000):
+            lines = io.StringIO(universe + "\n")
+            assert solve_stream(lines, factor) == solve(universe, factor)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "path",
+        nargs="?",
+        help="a universe to read line by line (default: the example)",
+    )
+    parser.add_argument("--factor", type=int, default=2)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+
+    if args.path:
+        with open(args.path) as universe:
+            print(solve_stream(universe, args.factor))
+    else:
+        print(solve(EXAMPLE, args.factor))
@@ -0,0 +1,281 @@
+import argparse
+import collections
+import concurrent.futures
+import random
+import sys
+
+import numpy
+
+import main
+
+
+BLOCK = 2048
+
+
+def as_array(galaxies):
+    return numpy.array(galaxies, dtype=numpy.int64).reshape(-1, 2)
+
+
+# The galaxies with every empty row and column made factor wide, as in
+# main.expanded_axis_distance but for all of them at once.
+def expand(points, factor=2):
+    expanded = points.copy()
+
+    for axis in range(2):
+        positions = points[:, axis]
+        occupied_before = numpy.searchsorted(numpy.unique(positions), positions)
+        expanded[:, axis] += (factor - 1) * (positions - occupied_before)
+
+    return expanded
+
+
+# Distances from the galaxies in rows to every galaxy in columns, as a
+# len(rows) x len(columns) matrix.
+def distances(rows, columns):
+    return (
+        numpy.abs(rows[:, None, 0] - columns[None, :, 0]) +
+        numpy.abs(rows[:, None, 1] - columns[None, :, 1])
+    )
+
+
+# Each pair is visited once, a block of rows at a time, so no more than
+# block x G distances are held at once. A block's pairs are those within
+# it, above the diagonal, and those from it to every later galaxy.
+# Returns the first as a flat array alongside their row and column in
+# the block, and the second as a matrix whose column j is galaxy
+# start + block + j.
+def pair_blocks(points, start, block):
+    rows = points[start:start + block]
+    i, j = numpy.triu_indices(len(rows), 1)
+    within = distances(rows, rows)[i, j]
+    after = distances(rows, points[start + block:])
+    return within, i, j, after
+
+
+def total_distance_block(points, start, block):
+    within, _, _, after = pair_blocks(points, start, block)
+    return int(within.sum()) + int(after.sum())
+
+
+# The distances in a block, in bins width wide, with how many pairs fall
+# in each bin.
+def histogram_block(points, start, block, width):
+    within, _, _, after = pair_blocks(points, start, block)
+    return numpy.unique(
+        numpy.concatenate((within, after.ravel())) // width,
+        return_counts=True,
+    )
+
+
+# Two sparse histograms added together, each as sorted distinct values
+# with their counts.
+def merge_counts(values, counts, more_values, more_counts):
+    merged = numpy.union1d(values, more_values)
+    merged_counts = numpy.zeros(len(merged), dtype=numpy.int64)
+    merged_counts[numpy.searchsorted(merged, values)] += counts
+    merged_counts[numpy.searchsorted(merged, more_values)] += more_counts
+    return merged, merged_counts
+
+
+def closest_pairs_block(points, start, block, k):
+    within, i, j, after = pair_blocks(points, start, block)
+    rows, columns = numpy.divmod(numpy.arange(after.size), max(after.shape[1], 1))
+    pair_distances = numpy.concatenate((within, after.ravel()))
+    rows = start + numpy.concatenate((i, rows))
+    columns = start + numpy.concatenate((j, block + columns))
+    if len(pair_distances) > k:
+        # Everything tied with the k-th closest is kept, so that the
+        # merge can break ties by index.
+        kth = numpy.partition(pair_distances, k - 1)[k - 1]
+        nearest = pair_distances <= kth
+        rows, columns, pair_distances = rows[nearest], columns[nearest], pair_distances[nearest]
+    return pair_distances, rows, columns
+
+
+# Yields f(points, start, block, *args) for every block of rows in
+# order, on jobs worker processes when jobs > 1. Each worker is sent the
+# points once, and at most two blocks per worker are in flight, so
+# results that are consumed as they arrive never pile up.
+def map_blocks(f, points, block, jobs, *args):
+    starts = range(0, len(points), block)
+
+    if jobs == 1:
+        for start in starts:
+            yield f(points, start, block, *args)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(
+        jobs,
+        initializer=_set_points,
+        initargs=(points,),
+    ) as executor:
+        pending = collections.deque()
+        for start in starts:
+            pending.append(executor.submit(_call_with_points, (f, start, block, args)))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+_points = None
+
+
+def _set_points(points):
+    global _points
+    _points = points
+
+
+def _call_with_points(task):
+    f, start, block, args = task
+    return f(_points, start, block, *args)
+
+
+# main.total_distance, blocked. Each block's sum fits in 64 bits; the
+# total is kept as a Python int.
+def total_distance(points, block=BLOCK, jobs=1):
+    return sum(map_blocks(total_distance_block, points, block, jobs))
+
+
+# The index of each galaxy's nearest other galaxy and the distance to it.
+# With fewer than two galaxies there are no neighbours, and both are empty.
+def nearest_neighbours(points, block=BLOCK):
+    if len(points) < 2:
+        return numpy.empty(0, dtype=numpy.int64), numpy.empty(0, dtype=numpy.int64)
+
+    neighbours = numpy.empty(len(points), dtype=numpy.int64)
+    nearest = numpy.empty(len(points), dtype=numpy.int64)
+
+    for start in range(0, len(points), block):
+        block_distances = distances(points[start:start + block], points)
+        rows = numpy.arange(len(block_distances))
+        block_distances[rows, start + rows] = numpy.iinfo(numpy.int64).max
+        neighbours[start:start + block] = block_distances.argmin(axis=1)
+        nearest[start:start + block] = block_distances[rows, neighbours[start:start + block]]
+
+    return neighbours, nearest
+
+
+# The distances between galaxies, ascending, and how many pairs are each
+# one apart. Only distances that occur are counted, since with a large
+# factor the range of distances is far bigger than the number of pairs,
+# and each block is merged in as it finishes. When nearly every distance
+# is distinct that is still one entry per pair, so width > 1 counts bins
+# of that many distances instead, each given by its lowest distance,
+# which bounds the result by the span of distances over width.
+def distance_histogram(points, block=BLOCK, jobs=1, width=1):
+    values = numpy.empty(0, dtype=numpy.int64)
+    counts = numpy.empty(0, dtype=numpy.int64)
+    for block_values, block_counts in map_blocks(histogram_block, points, block, jobs, width):
+        values, counts = merge_counts(values, counts, block_values, block_counts)
+    return values * width, counts
+
+
+# The k closest pairs as (distance, i, j) with i < j, closest first and
+# then by index. Each block keeps only its own k closest, and any ties
+# with them, so the merge sees little more than k per block.
+def closest_pairs(points, k, block=BLOCK, jobs=1):
+    results = list(map_blocks(closest_pairs_block, points, block, jobs, k))
+    if not results:
+        return []
+    pair_distances = numpy.concatenate([result[0] for result in results])
+    rows = numpy.concatenate([result[1] for result in results])
+    columns = numpy.concatenate([result[2] for result in results])
+
+    order = numpy.lexsort((columns, rows, pair_distances))[:k]
+
+    return [
+        (int(pair_distances[i]), int(rows[i]), int(columns[i]))
+        for i in order
+    ]
+
+
+def test_total_distance_matches_solve_for_any_factor():
+    rng = random.Random(0)
+    for _ in range(50):
+        universe = main.random_universe(rng, rng.randint(1, 30), rng.randint(1, 30))
+        galaxies = as_array(main.find_galaxies(universe.splitlines()))
+        for factor in (1, 2, 10, 1000000):
+            assert total_distance(expand(galaxies, factor), block=7) == main.solve(universe, factor)
+
+
+def test_histogram_and_closest_pairs_match_every_pair():
+    rng = numpy.random.default_rng(0)
+    points = rng.integers(0, 10 ** 9, (300, 2))
+    pairs = sorted(
+        (int(numpy.abs(points[i] - points[j]).sum()), i, j)
+        for i in range(len(points)) for j in range(i + 1, len(points))
+    )
+    values, counts = distance_histogram(points, block=64)
+    expected_values, expected_counts = numpy.unique([d for d, _, _ in pairs], return_counts=True)
+    assert values.tolist() == expected_values.tolist()
+    assert counts.tolist() == expected_counts.tolist()
+    width = 10 ** 7
+    values, counts = distance_histogram(points, block=64, jobs=2, width=width)
+    expected_values, expected_counts = numpy.unique([d // width for d, _, _ in pairs], return_counts=True)
+    assert values.tolist() == (expected_values * width).tolist()
+    assert counts.tolist() == expected_counts.tolist()
+    assert closest_pairs(points, 10, block=64) == pairs[:10]
+
+
+def test_no_galaxies():
+    points = as_array([])
+    assert total_distance(points) == 0
+    values, counts = distance_histogram(points)
+    assert len(values) == len(counts) == 0
+    assert closest_pairs(points, 5) == []
+    for points in (as_array([]), as_array([(3, 4)])):
+        neighbours, nearest = nearest_neighbours(points)
+        assert len(neighbours) == len(nearest) == 0
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "path",
+        nargs="?",
+        help="a universe to read (default: the example)",
+    )
+    parser.add_argument("--factor", type=int, default=2)
+    parser.add_argument("-k", type=int, default=5, help="closest pairs to list")
+    parser.add_argument("--block", type=int, default=BLOCK)
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument(
+        "--bin-width",
+        type=int,
+        default=1,
+        help="count pair distances in bins this wide, to bound memory",
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+
+    if args.path:
+        with open(args.path) as universe:
+            galaxies = main.find_galaxies(universe)
+    else:
+        galaxies = main.find_galaxies(main.EXAMPLE.splitlines())
+
+    points = expand(as_array(galaxies), args.factor)
+    _, nearest = nearest_neighbours(points, args.block)
+    pair_distances, counts = distance_histogram(
+        points, args.block, args.jobs, args.bin_width,
+    )
+
+    print("galaxies", len(points))
+    print("total distance", total_distance(points, args.block, args.jobs))
+    if len(nearest):
+        print("mean nearest neighbour distance", nearest.mean())
+    if len(counts):
+        median = pair_distances[numpy.searchsorted(
+            numpy.cumsum(counts), (counts.sum() + 1) // 2,
+        )]
+        if args.bin_width == 1:
+            print("median pair distance", median)
+        else:
+            print("median pair distance", median, "to", median + args.bin_width - 1)
+
+    for distance, i, j in closest_pairs(points, args.k, args.block, args.jobs):
+        print("pair", galaxies[i], galaxies[j], distance)
@@ -0,0 +1,71 @@
+import argparse
+import sys
+import time
+
+import main
+
+COINS = [50, 25, 10, 5, 1]
+
+def best_time(f, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+# Seconds to count the combinations for each amount: by listing them all
+# with make_change, by walking iter_change, by count_change, and by the
+# cached tables of coin_system, which are built once up front.
+def bench(amounts, max_recursive_amount):
+    print("{:>8} {:>16} {:>12} {:>12} {:>12} {:>12}".format(
+        "amount", "combinations", "make_change", "iter_change", "count", "cached",
+    ))
+    for amount in amounts:
+        if amount <= max_recursive_amount:
+            recursive = "{:11.4f}s".format(best_time(
+                lambda: len(main.make_change(amount, COINS)),
+            ))
+            walked = "{:11.4f}s".format(best_time(
+                lambda: sum(1 for _ in main.iter_change(amount, COINS)),
+            ))
+        else:
+            recursive = walked = "-"
+        counted = best_time(lambda: main.count_change(amount, COINS))
+        main.coin_system.cache_clear()
+        system = main.coin_system(tuple(COINS))
+        system.count(max(amounts))
+        system.min_coins(max(amounts))
+        cached = best_time(lambda: (
+            system.count(amount),
+            system.min_coins(amount),
+            system.kth(amount, 0),
+        ))
+        print("{:>8} {:>16} {:>12} {:>12} {:11.4f}s {:11.6f}s".format(
+            amount,
+            main.count_change(amount, COINS),
+            recursive,
+            walked,
+            counted,
+            cached,
+        ))
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--amounts",
+        type=int,
+        nargs="+",
+        default=[100, 200, 400, 1000, 10000, 100000],
+    )
+    parser.add_argument(
+        "--max-recursive-amount",
+        type=int,
+        default=400,
+        help="skip make_change and iter_change above this amount",
+    )
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    bench(args.amounts, args.max_recursive_amount)
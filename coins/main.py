@@ -1,3 +1,14 @@
+import csv
+import functools
+import io
+import itertools
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 def make_change(amount, coins):
     if coins == [] or amount < 0:
         return []
@@ -19,6 +30,253 @@ def _add_coin(result, coin):
     result[coin] += 1
     return result
 
+# The number of results make_change would return, in O(amount * coins):
+# ways[a] counts the ways to make a from the coins seen so far.
+def count_change(amount, coins):
+    if coins == [] or amount < 0:
+        return 0
+
+    ways = [1] + [0] * amount
+    for coin in coins:
+        for a in range(coin, amount + 1):
+            ways[a] += ways[a - coin]
+    return ways[amount]
+
+# The results of make_change, in the same order, one at a time.
+def iter_change(amount, coins):
+    if coins == [] or amount < 0:
+        return iter([])
+    return _iter_change(amount, coins, {})
+
+def _iter_change(amount, coins, counts):
+    first_coin = coins[0]
+    if len(coins) == 1:
+        if amount % first_coin == 0:
+            # A fresh dict, as callers may change what they are given.
+            yield _with_coins(counts.copy(), first_coin, amount // first_coin)
+        return
+
+    for n in range(amount // first_coin, -1, -1):
+        yield from _iter_change(
+            amount - n * first_coin,
+            coins[1:],
+            _with_coins(counts, first_coin, n),
+        )
+
+def _with_coins(result, coin, n):
+    if n == 0:
+        return result
+    result = result.copy()
+    result[coin] = result.get(coin, 0) + n
+    return result
+
+# Tables for one coin system, each grown only when a query needs it and
+# then to at least double its size. coin_system's LRU cache shares them
+# between queries up to MAX_CACHED_AMOUNT; above that a query builds its
+# own, just big enough, and lets it go.
+MAX_CACHED_AMOUNT = 1 << 16
+
+class CoinSystem:
+    def __init__(self, coins, max_amount=None):
+        self.coins = coins
+        self.max_amount = max_amount
+        self.fewest = array("q", [0])
+        self.ways = [[1] for _ in range(len(coins) + 1)]
+
+    def _size(self, amount, length):
+        size = 2 * length
+        if self.max_amount is not None:
+            size = min(size, self.max_amount + 1)
+        return max(amount + 1, size)
+
+    def _grow_fewest(self, amount):
+        if amount < len(self.fewest):
+            return
+        self.fewest = fewest_table(self.coins, self._size(amount, len(self.fewest)))
+
+    def _grow_ways(self, amount):
+        if amount < len(self.ways[0]):
+            return
+        size = self._size(amount, len(self.ways[0]))
+
+        # ways[i][a] counts the ways to make a from coins[i:].
+        ways = [[1] + [0] * (size - 1)]
+        for coin in reversed(self.coins):
+            row = ways[0][:]
+            for a in range(coin, size):
+                row[a] += row[a - coin]
+            ways.insert(0, row)
+        self.ways = ways
+
+    def min_coins(self, amount):
+        self._grow_fewest(amount)
+        fewest = int(self.fewest[amount])
+        return None if fewest < 0 else fewest
+
+    def count(self, amount):
+        self._grow_ways(amount)
+        return self.ways[0][amount]
+
+    # The combination iter_change would yield k-th, counting from 0,
+    # found by skipping whole blocks of combinations that share a count
+    # of the first coin.
+    def kth(self, amount, k):
+        self._grow_ways(amount)
+        if not 0 <= k < self.ways[0][amount]:
+            raise IndexError("there are only %d combinations" % self.ways[0][amount])
+
+        result = {}
+        for i, coin in enumerate(self.coins):
+            for n in range(amount // coin, -1, -1):
+                ways = self.ways[i + 1][amount - n * coin]
+                if k < ways:
+                    break
+                k -= ways
+            if n:
+                result[coin] = result.get(coin, 0) + n
+            amount -= n * coin
+        return result
+
+# fewest[a] is the fewest coins making a, or -1 if none do. Adding a
+# coin c lets any amount be reached from c less for one more coin, so
+# along each residue mod c, fewest[r + k*c] becomes the least of
+# fewest[r + j*c] + (k - j) for j <= k: a running minimum of
+# fewest[r + j*c] - j, which NumPy takes down the columns of the table
+# laid out c wide.
+def fewest_table(coins, size):
+    if numpy is None:
+        fewest = array("q", [-1]) * size
+        fewest[0] = 0
+        for coin in coins:
+            for a in range(coin, size):
+                if fewest[a - coin] >= 0 and (fewest[a] < 0 or fewest[a - coin] < fewest[a] - 1):
+                    fewest[a] = fewest[a - coin] + 1
+        return fewest
+
+    unreachable = numpy.iinfo(numpy.int64).max // 2
+    fewest = numpy.full(size, unreachable, dtype=numpy.int64)
+    fewest[0] = 0
+    for coin in coins:
+        rows = -(-size // coin)
+        table = numpy.full(rows * coin, unreachable, dtype=numpy.int64)
+        table[:size] = fewest
+        table = table.reshape(rows, coin)
+        steps = numpy.arange(rows, dtype=numpy.int64)[:, None]
+        fewest = (numpy.minimum.accumulate(table - steps, axis=0) + steps).ravel()[:size]
+    fewest[fewest >= unreachable] = -1
+    return fewest
+
+@functools.lru_cache(maxsize=8)
+def coin_system(coins):
+    return CoinSystem(coins, MAX_CACHED_AMOUNT)
+
+# The cached tables for coins, unless amount is too big to keep them.
+def system_for(coins, amount):
+    if amount > MAX_CACHED_AMOUNT:
+        return CoinSystem(coins)
+    return coin_system(coins)
+
+# The fewest coins that make amount, or None if it cannot be made.
+def min_coins(amount, coins):
+    if coins == [] or amount < 0:
+        return None
+    return system_for(tuple(coins), amount).min_coins(amount)
+
+def kth_change(amount, coins, k):
+    if coins == [] or amount < 0:
+        raise IndexError("there are no combinations")
+    return system_for(tuple(coins), amount).kth(amount, k)
+
+# The number of ways to make amount using at most supply[i] of coins[i].
+# Each coin adds a sliding window sum over the previous table, keeping
+# it O(amount * coins) however large the supply.
+def count_change_limited(amount, coins, supply):
+    if coins == [] or amount < 0:
+        return 0
+
+    ways = [1] + [0] * amount
+    for coin, limit in zip(coins, supply):
+        previous = ways
+        ways = previous[:]
+        for a in range(coin, amount + 1):
+            ways[a] += ways[a - coin]
+            if a >= (limit + 1) * coin:
+                ways[a] -= previous[a - (limit + 1) * coin]
+    return ways[amount]
+
+# The results of iter_change as tuples of counts, one per coin in coins,
+# so that no dict is built per combination.
+def iter_change_counts(amount, coins):
+    if coins == [] or amount < 0:
+        return iter([])
+    return _iter_change_counts(amount, coins, 0, [0] * len(coins))
+
+def _iter_change_counts(amount, coins, i, counts):
+    coin = coins[i]
+    if i == len(coins) - 1:
+        if amount % coin == 0:
+            counts[i] = amount // coin
+            yield tuple(counts)
+        return
+
+    for n in range(amount // coin, -1, -1):
+        counts[i] = n
+        yield from _iter_change_counts(amount - n * coin, coins, i + 1, counts)
+
+# The results of iter_change as a NumPy array with a row per combination
+# and a column per coin. Rows that share a count of a coin are contiguous,
+# so each count is written to a whole block of rows at once, sized from
+# the cached tables. The last two columns are worked out per block: every
+# count of the second last coin that leaves a multiple of the last one.
+def change_matrix(amount, coins):
+    if coins == [] or amount < 0:
+        return numpy.zeros((0, len(coins)), dtype=numpy.int64)
+
+    system = system_for(tuple(coins), amount)
+    matrix = numpy.zeros((system.count(amount), len(coins)), dtype=numpy.int64)
+    if len(coins) == 1:
+        matrix[:, 0] = amount // coins[0]
+    else:
+        _fill_change_matrix(matrix, system, amount, 0, 0)
+    return matrix
+
+def _fill_change_matrix(matrix, system, amount, i, row):
+    coin = system.coins[i]
+    if i == len(system.coins) - 2:
+        last_coin = system.coins[-1]
+        counts = numpy.arange(amount // coin, -1, -1)
+        counts = counts[(amount - counts * coin) % last_coin == 0]
+        matrix[row:row + len(counts), i] = counts
+        matrix[row:row + len(counts), i + 1] = (amount - counts * coin) // last_coin
+        return
+
+    for n in range(amount // coin, -1, -1):
+        rows = system.ways[i + 1][amount - n * coin]
+        if rows:
+            matrix[row:row + rows, i] = n
+            _fill_change_matrix(matrix, system, amount - n * coin, i + 1, row)
+            row += rows
+
+# Writes the results of iter_change to f as CSV, a header of coins and
+# then a row of counts per combination.
+def write_change_csv(amount, coins, f):
+    writer = csv.writer(f)
+    writer.writerow(coins)
+    writer.writerows(iter_change_counts(amount, coins))
+
+# Writes the results of iter_change to binary f as native 64-bit ints, a
+# row of counts per combination, rows at a time. Read it back with
+# numpy.fromfile(path, dtype=numpy.int64).reshape(-1, len(coins)).
+def write_change_binary(amount, coins, f, rows=1 << 16):
+    combinations = iter_change_counts(amount, coins)
+    while True:
+        counts = array("q", itertools.chain.from_iterable(
+            itertools.islice(combinations, rows)
+        ))
+        if not counts:
+            break
+        counts.tofile(f)
+
 def test_there_is_one_way_to_make_zero():
     result = make_change(0, [1])
     assert result == [{}]
@@ -38,3 +296,94 @@ def test_there_is_two_ways_to_make_two_with_ones_and_twos():
 def test_100():
     result = make_change(100, list(reversed([1, 5, 10, 25, 50])))
     assert len(result) == 292
+
+def test_count_change_matches_make_change():
+    for amount in range(30):
+        for coins in ([1], [2, 1], [5, 3], [25, 10, 5, 1], [1, 2, 2]):
+            assert count_change(amount, coins) == len(make_change(amount, coins))
+
+def test_count_change_of_large_amounts():
+    assert count_change(100, [50, 25, 10, 5, 1]) == 292
+    assert count_change(100000, [1, 5, 10, 25, 50]) == 66793412685001
+
+def test_iter_change_matches_make_change():
+    for amount in range(30):
+        for coins in ([], [1], [2, 1], [5, 3], [25, 10, 5, 1], [1, 2, 2]):
+            assert list(iter_change(amount, coins)) == make_change(amount, coins)
+
+def test_iter_change_is_lazy():
+    combinations = iter_change(100000, [1, 5, 10, 25, 50])
+    assert next(combinations) == {1: 100000}
+    assert next(combinations) == {1: 99995, 5: 1}
+
+def test_min_coins():
+    assert min_coins(0, [1]) == 0
+    assert min_coins(63, [25, 10, 5, 1]) == 6
+    assert min_coins(6, [1, 3, 4]) == 2
+    assert min_coins(7, [2, 4]) is None
+    assert min_coins(100000, [50, 25, 10, 5, 1]) == 2000
+
+def test_fewest_table_matches_make_change():
+    for coins in ([1], [2], [5, 3], [25, 10, 5, 1], [1, 3, 4], [7, 2, 2]):
+        fewest = fewest_table(coins, 40)
+        for amount in range(40):
+            combinations = make_change(amount, coins)
+            expected = min((sum(c.values()) for c in combinations), default=-1)
+            assert fewest[amount] == expected
+
+def test_min_coins_of_amounts_too_big_to_cache():
+    coin_system.cache_clear()
+    assert min_coins(MAX_CACHED_AMOUNT + 3, [5, 2]) == (MAX_CACHED_AMOUNT + 3) // 5 + 2
+    assert len(coin_system((5, 2)).fewest) == 1
+
+def test_kth_change_matches_iter_change():
+    for coins in ([1], [2, 1], [5, 3], [25, 10, 5, 1], [1, 2, 2]):
+        for amount in range(30):
+            for k, result in enumerate(iter_change(amount, coins)):
+                assert kth_change(amount, coins, k) == result
+
+def test_kth_change_is_checked():
+    try:
+        kth_change(100, [50, 25, 10, 5, 1], 292)
+    except IndexError:
+        pass
+    else:
+        assert False
+
+def test_count_change_limited():
+    coins, supply = [25, 10, 5, 1, 1], [1, 2, 3, 4, 0]
+    for amount in range(60):
+        expected = sum(
+            sum(n * coin for n, coin in zip(counts, coins)) == amount
+            for counts in itertools.product(*[range(limit + 1) for limit in supply])
+        )
+        assert count_change_limited(amount, coins, supply) == expected
+
+def test_iter_change_counts_matches_iter_change():
+    for coins in ([], [1], [2, 1], [25, 10, 5, 1]):
+        for amount in range(30):
+            assert [
+                {coin: n for coin, n in zip(coins, counts) if n}
+                for counts in iter_change_counts(amount, coins)
+            ] == list(iter_change(amount, coins))
+
+def test_change_matrix_matches_iter_change_counts():
+    if numpy is None:
+        return
+    for coins in ([], [1], [2, 1], [5, 3], [25, 10, 5, 1], [1, 2, 2]):
+        for amount in range(30):
+            matrix = change_matrix(amount, coins)
+            assert matrix.shape == (count_change(amount, coins), len(coins))
+            assert [tuple(row) for row in matrix.tolist()] == list(iter_change_counts(amount, coins))
+
+def test_write_change_csv():
+    f = io.StringIO()
+    write_change_csv(2, [1, 2], f)
+    assert f.getvalue().splitlines() == ["1,2", "2,0", "0,1"]
+
+def test_write_change_binary():
+    f = io.BytesIO()
+    write_change_binary(100, [50, 25, 10, 5, 1], f, rows=7)
+    counts = array("q", f.getvalue())
+    assert len(counts) == 292 * 5
+    assert tuple(counts[:5]) == (2, 0, 0, 0, 0)
@@ -0,0 +1,177 @@
+import argparse
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import builder
+import fake_server
+import voxels
+import writer
+
+# Stands in for the Craft server: accepts one connection at a time and
+# counts the lines it receives, noting when the client hung up.
+class StandInServer(object):
+    def __init__(self, host='127.0.0.1'):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind((host, 0))
+        self.sock.listen(1)
+        self.host, self.port = self.sock.getsockname()
+        self.lines = 0
+        self.finished = None
+        self.done = threading.Event()
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while True:
+            conn, _ = self.sock.accept()
+            lines = 0
+            while True:
+                data = conn.recv(1 << 16)
+                if not data:
+                    break
+                lines += data.count(b'\n')
+            conn.close()
+            self.lines = lines
+            self.finished = time.perf_counter()
+            self.done.set()
+
+    def run(self, f, **kwargs):
+        self.done.clear()
+        start = time.perf_counter()
+        with builder.Client(self.host, self.port, **kwargs) as client:
+            f(client)
+        self.done.wait()
+        return self.lines, self.finished - start
+
+def bench_set_blocks(radius):
+    server = StandInServer()
+    blocks = builder.sphere(0, radius + 1, 0, radius, fill=True)
+    runs = [
+        ('unbuffered', dict(buffer_size=0), True),
+        ('buffered', dict(), True),
+        ('buffered, no clear', dict(), False),
+    ]
+    print('%d blocks' % len(blocks))
+    for name, kwargs, clear in runs:
+        lines, elapsed = server.run(
+            lambda client: client.set_blocks(blocks, builder.STONE, clear),
+            **kwargs
+        )
+        print('%-20s %8d lines %10.0f blocks/s' % (
+            name, lines, len(blocks) / elapsed,
+        ))
+
+# Blocks per second through the socket, against straight into SQLite,
+# for the same sphere.
+def bench_writer(radius):
+    blocks = builder.sphere(0, radius + 1, 0, radius, fill=True)
+    print('%d blocks' % len(blocks))
+    server = StandInServer()
+    _, elapsed = server.run(
+        lambda client: client.set_blocks(blocks, builder.STONE),
+    )
+    print('%-10s %10.0f blocks/s' % ('socket', len(blocks) / elapsed))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'craft.db')
+        start = time.perf_counter()
+        with writer.Writer(path) as w:
+            w.set_blocks(blocks, builder.STONE)
+        elapsed = time.perf_counter() - start
+        print('%-10s %10.0f blocks/s %10.0f rows/s' % (
+            'sqlite', len(blocks) / elapsed, w.rows / elapsed,
+        ))
+
+# Overlapping shapes, with one drawn twice, as a scripted build would.
+def overlapping_shapes(radius):
+    return [
+        builder.sphere(0, radius + 1, 0, radius),
+        builder.cylinder_x(-2 * radius, 2 * radius, radius + 1, 0, radius // 2),
+        builder.sphere(0, radius + 1, 0, radius),
+    ]
+
+# Time until the server has applied every write, for each order, with
+# and without dedup.
+def bench_order(radius, host, port):
+    if host is None:
+        server = fake_server.start_thread()
+        host, port = server.host, server.port
+    shapes = overlapping_shapes(radius)
+    print('%d blocks in %d shapes' % (sum(map(len, shapes)), len(shapes)))
+    for name, order in sorted(builder.ORDERS.items()):
+        for dedup in (False, True):
+            with builder.Client(host, port, order=order, dedup=dedup) as client:
+                start = time.perf_counter()
+                for blocks in shapes:
+                    client.set_blocks(blocks, builder.STONE)
+                client.sync()
+                elapsed = time.perf_counter() - start
+            print('%-8s %-9s %8d sent %8d skipped %8.3fs to apply' % (
+                name, 'dedup' if dedup else '', client.sent, client.skipped,
+                elapsed,
+            ))
+
+def best_time(f, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench_shapes(radii, max_loop_radius):
+    print('%6s %10s %10s %10s %10s %10s' % (
+        'r', 'blocks', 'loop', 'array', 'set', 'voxels',
+    ))
+    for r in radii:
+        blocks = len(builder.sphere_array(0, 0, 0, r))
+        if r <= max_loop_radius:
+            loop = '%9.3fs' % best_time(
+                lambda: builder.sphere_loop(0, 0, 0, r), repeat=1,
+            )
+        else:
+            loop = '-'
+        array = best_time(lambda: builder.sphere_array(0, 0, 0, r))
+        as_set = best_time(lambda: builder.sphere(0, 0, 0, r))
+        as_voxels = best_time(lambda: voxels.sphere(0, 0, 0, r))
+        print('%6d %10d %10s %9.3fs %9.3fs %9.3fs' % (
+            r, blocks, loop, array, as_set, as_voxels,
+        ))
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('bench', choices=['set-blocks', 'shapes', 'writer', 'order'])
+    parser.add_argument('--radius', type=int, default=29)
+    parser.add_argument(
+        '--host',
+        help='a Craft server for order to write to (default: a FakeServer)',
+    )
+    parser.add_argument('--port', type=int, default=builder.DEFAULT_PORT)
+    parser.add_argument(
+        '--radii',
+        type=int,
+        nargs='+',
+        default=[16, 32, 64, 128, 256],
+    )
+    parser.add_argument(
+        '--max-loop-radius',
+        type=int,
+        default=64,
+        help='skip the pure Python sphere above this radius',
+    )
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    if args.bench == 'set-blocks':
+        bench_set_blocks(args.radius)
+    elif args.bench == 'shapes':
+        bench_shapes(args.radii, args.max_loop_radius)
+    elif args.bench == 'writer':
+        bench_writer(args.radius)
+    elif args.bench == 'order':
+        bench_order(args.radius, args.host, args.port)
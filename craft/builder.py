@@ -2,13 +2,23 @@
 # Please use this wisely. Test on your own server first. Do not abuse it.
 
 #import requests
+import asyncio
 import socket
 import sqlite3
 import sys
 import time
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 DEFAULT_HOST = '127.0.0.1'
 DEFAULT_PORT = 4080
+BUFFER_SIZE = 64 * 1024
+CHUNK_SIZE = 32
+# Past any block's rowid, so a chunk request asks for nothing new.
+SYNC_KEY = 1 << 62
 
 EMPTY = 0
 GRASS = 1
@@ -47,6 +57,11 @@ OFFSETS = [
 ]
 
 def sphere(cx, cy, cz, r, fill=False, fx=False, fy=False, fz=False):
+    if numpy is not None:
+        return to_set(sphere_array(cx, cy, cz, r, fill, fx, fy, fz))
+    return sphere_loop(cx, cy, cz, r, fill, fx, fy, fz)
+
+def sphere_loop(cx, cy, cz, r, fill=False, fx=False, fy=False, fz=False):
     result = set()
     for x in range(cx - r, cx + r + 1):
         if fx and x != cx:
@@ -84,6 +99,8 @@ def circle_z(x, y, z, r, fill=False):
 
 def cylinder_x(x1, x2, y, z, r, fill=False):
     x1, x2 = sorted((x1, x2))
+    if numpy is not None:
+        return to_set(extrude(circle_x_array(x1, y, z, r, fill), 0, x2 - x1))
     result = set()
     for x in range(x1, x2 + 1):
         result |= circle_x(x, y, z, r, fill)
@@ -91,6 +108,8 @@ def cylinder_x(x1, x2, y, z, r, fill=False):
 
 def cylinder_y(x, y1, y2, z, r, fill=False):
     y1, y2 = sorted((y1, y2))
+    if numpy is not None:
+        return to_set(extrude(circle_y_array(x, y1, z, r, fill), 1, y2 - y1))
     result = set()
     for y in range(y1, y2 + 1):
         result |= circle_y(x, y, z, r, fill)
@@ -98,12 +117,19 @@ def cylinder_y(x, y1, y2, z, r, fill=False):
 
 def cylinder_z(x, y, z1, z2, r, fill=False):
     z1, z2 = sorted((z1, z2))
+    if numpy is not None:
+        return to_set(extrude(circle_z_array(x, y, z1, r, fill), 2, z2 - z1))
     result = set()
     for z in range(z1, z2 + 1):
         result |= circle_z(x, y, z, r, fill)
     return result
 
 def cuboid(x1, x2, y1, y2, z1, z2, fill=True):
+    if numpy is not None:
+        return to_set(cuboid_array(x1, x2, y1, y2, z1, z2, fill))
+    return cuboid_loop(x1, x2, y1, y2, z1, z2, fill)
+
+def cuboid_loop(x1, x2, y1, y2, z1, z2, fill=True):
     x1, x2 = sorted((x1, x2))
     y1, y2 = sorted((y1, y2))
     z1, z2 = sorted((z1, z2))
@@ -121,6 +147,87 @@ def cuboid(x1, x2, y1, y2, z1, z2, fill=True):
                 result.add((x, y, z))
     return result
 
+# NumPy versions of the shapes above, returning an (n, 3) array of block
+# coordinates. A block is in a sphere's shell when one of its corners is
+# inside the sphere and another is not. Working in doubled coordinates
+# keeps the corner offsets whole, so squared distances are compared
+# exactly as integers, with no square roots. The nearest and furthest
+# corners are found axis by axis, and the mask is built one x slab at a
+# time so memory stays at O(r ** 2).
+def sphere_array(cx, cy, cz, r, fill=False, fx=False, fy=False, fz=False):
+    slabs = sphere_slabs(cx, cy, cz, r, fill, fx, fy, fz)
+    return numpy.concatenate([numpy.empty((0, 3), dtype=numpy.int64)] + list(slabs))
+
+# The sphere one x slab at a time, for callers that never need it whole.
+def sphere_slabs(cx, cy, cz, r, fill=False, fx=False, fy=False, fz=False):
+    dx, near_x, far_x = sphere_axis(r, fx)
+    dy, near_y, far_y = sphere_axis(r, fy)
+    dz, near_z, far_z = sphere_axis(r, fz)
+    near_yz = near_y[:, None] + near_z[None, :]
+    far_yz = far_y[:, None] + far_z[None, :]
+    r2 = 4 * r * r
+    for i in range(len(dx)):
+        mask = near_yz < r2 - near_x[i]
+        if not fill:
+            mask &= far_yz >= r2 - far_x[i]
+        iy, iz = numpy.nonzero(mask)
+        yield numpy.column_stack((
+            numpy.full(len(iy), cx + dx[i]),
+            cy + dy[iy],
+            cz + dz[iz],
+        ))
+
+def sphere_axis(r, fixed):
+    d = numpy.zeros(1, dtype=numpy.int64) if fixed else numpy.arange(-r, r + 1)
+    low, high = (2 * d - 1) ** 2, (2 * d + 1) ** 2
+    return d, numpy.minimum(low, high), numpy.maximum(low, high)
+
+def circle_x_array(x, y, z, r, fill=False):
+    return sphere_array(x, y, z, r, fill, fx=True)
+
+def circle_y_array(x, y, z, r, fill=False):
+    return sphere_array(x, y, z, r, fill, fy=True)
+
+def circle_z_array(x, y, z, r, fill=False):
+    return sphere_array(x, y, z, r, fill, fz=True)
+
+# Copies of points stepped 0..length along an axis.
+def extrude(points, axis, length):
+    steps = numpy.arange(length + 1)
+    result = numpy.repeat(points[None, :, :], len(steps), axis=0)
+    result[:, :, axis] += steps[:, None]
+    return result.reshape(-1, 3)
+
+def grid(xs, ys, zs):
+    return numpy.stack(
+        numpy.meshgrid(xs, ys, zs, indexing='ij'), axis=-1,
+    ).reshape(-1, 3)
+
+# A hollow cuboid is built a face at a time: the two ends of each axis
+# more than one block long, less the edges already in the ends of the
+# axes before it. Its interior is never made, so a big one costs only
+# its surface.
+def cuboid_array(x1, x2, y1, y2, z1, z2, fill=True):
+    bounds = [sorted((x1, x2)), sorted((y1, y2)), sorted((z1, z2))]
+    full = [numpy.arange(lo, hi + 1) for lo, hi in bounds]
+    if fill:
+        return grid(*full)
+    faces = [numpy.zeros((0, 3), dtype=numpy.int64)]
+    for axis, (lo, hi) in enumerate(bounds):
+        if lo == hi:
+            continue
+        ranges = [
+            numpy.arange(l + 1, h) if l < h else full[i]
+            for i, (l, h) in enumerate(bounds[:axis])
+        ]
+        ranges.append(numpy.array([lo, hi]))
+        ranges.extend(full[axis + 1:])
+        faces.append(grid(*ranges))
+    return numpy.concatenate(faces)
+
+def to_set(points):
+    return set(map(tuple, points.tolist()))
+
 def pyramid(x1, x2, y, z1, z2, fill=False):
     x1, x2 = sorted((x1, x2))
     z1, z2 = sorted((z1, z2))
@@ -130,6 +237,43 @@ def pyramid(x1, x2, y, z1, z2, fill=False):
         y, x1, x2, z1, z2 = y + 1, x1 + 1, x2 - 1, z1 + 1, z2 - 1
     return result
 
+def chunked(x):
+    return x // CHUNK_SIZE
+
+# Orders for set_blocks: each takes the blocks and returns them in the
+# order to send. Any function of that shape can be passed to Client or
+# AsyncClient.
+
+# Layer by layer from the bottom, as builds have always gone out.
+def order_layers(blocks):
+    return sorted(blocks, key=lambda block: (block[1], block[0], block[2]))
+
+# One chunk at a time, so the server loads and saves each chunk once,
+# and along a Z-order curve within it, so nearby writes stay together.
+def order_chunks(blocks):
+    def key(block):
+        x, y, z = block
+        local = morton(x % CHUNK_SIZE, y & 0xffff, z % CHUNK_SIZE)
+        return chunked(x), chunked(z), local
+    return sorted(blocks, key=key)
+
+# SPREAD[i] has the bits of byte i spaced three apart.
+SPREAD = [
+    sum(((i >> bit) & 1) << (3 * bit) for bit in range(8))
+    for i in range(256)
+]
+
+def spread(v):
+    return SPREAD[v & 0xff] | (SPREAD[v >> 8] << 24)
+
+def morton(x, y, z):
+    return spread(x) | (spread(y) << 1) | (spread(z) << 2)
+
+ORDERS = {
+    'layers': order_layers,
+    'chunks': order_chunks,
+}
+
 def get_identity():
     query = (
         'select username, token from identity_token where selected = 1;'
@@ -140,11 +284,76 @@ def get_identity():
         return row
     raise Exception('No identities found.')
 
+# What craft.db says is in the world, read a chunk at a time through the
+# (p, q) prefix of the block index. A block on a chunk border is also
+# stored in its neighbours with its w negated, so only the rows of the
+# chunk that owns the block are kept. The database is only as fresh as
+# the server's last save, and writes made through a Client are noted
+# here so that repeating them in one session is still skipped. The
+# database only holds edits, and the server fills in generated terrain
+# wherever there is no row, so a block with no row is unknown (None),
+# not EMPTY. With no path, nothing is known until it is written, which
+# only dedups.
+class World(object):
+    def __init__(self, path=None):
+        self.db = sqlite3.connect(path) if path else None
+        self.chunks = {}
+    def chunk(self, p, q):
+        chunk = self.chunks.get((p, q))
+        if chunk is None and self.db is None:
+            chunk = self.chunks[(p, q)] = {}
+        elif chunk is None:
+            rows = self.db.execute(
+                'select x, y, z, w from block where p = ? and q = ?;',
+                (p, q),
+            )
+            chunk = self.chunks[(p, q)] = {
+                (x, y, z): w for x, y, z, w in rows
+                if chunked(x) == p and chunked(z) == q
+            }
+        return chunk
+    def get(self, x, y, z):
+        return self.chunk(chunked(x), chunked(z)).get((x, y, z))
+    def set(self, x, y, z, w):
+        self.chunk(chunked(x), chunked(z))[(x, y, z)] = w
+
 class Client(object):
-    def __init__(self, host, port):
+    def __init__(self, host, port, buffer_size=BUFFER_SIZE, world=None,
+                 order=order_layers, dedup=False):
         self.conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.conn.connect((host, port))
+        # Writes are already batched in the buffer, and sync() waits on
+        # the reply to a short C line that Nagle would otherwise hold
+        # back until the server's delayed ACK.
+        self.conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buffer = []
+        self.buffered = 0
+        self.buffer_size = buffer_size
+        # With a world, blocks that already hold w are skipped; dedup
+        # keeps one with no database, skipping what this client wrote.
+        if world is None and dedup:
+            world = World()
+        self.world = world
+        self.order = order
+        self.received = b''
+        self.sent = 0
+        self.skipped = 0
         self.authenticate()
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.flush()
+        self.conn.close()
+    def send(self, line):
+        self.buffer.append(line)
+        self.buffered += len(line)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+    def flush(self):
+        if self.buffer:
+            self.conn.sendall(''.join(self.buffer).encode())
+            self.buffer = []
+            self.buffered = 0
     def authenticate(self):
         # username, identity_token = get_identity()
         # url = 'https://craft.michaelfogleman.com/api/1/identity'
@@ -158,38 +367,249 @@ class Client(object):
         #     self.conn.sendall('A,%s,%s\n' % (username, access_token))
         # else:
         #     raise Exception('Failed to authenticate.')
-        self.conn.sendall('A,%s,%s\n' % ("x", 1))
-    def set_block(self, x, y, z, w):
-        self.conn.sendall('B,%d,%d,%d,%d\n' % (x, y, z, EMPTY))
-        self.conn.sendall('B,%d,%d,%d,%d\n' % (x, y, z, w))
-    def set_blocks(self, blocks, w):
-        key = lambda block: (block[1], block[0], block[2])
-        for x, y, z in sorted(blocks, key=key):
-            self.set_block(x, y, z, w)
+        self.send('A,%s,%s\n' % ("x", 1))
+        self.flush()
+    def set_block(self, x, y, z, w, clear=True):
+        if self.world is not None:
+            current = self.world.get(x, y, z)
+            if current == w:
+                self.skipped += 1
+                return
+            clear = clear and current != EMPTY
+            self.world.set(x, y, z, w)
+        self.sent += 1
+        # The server refuses to place a block in a non-empty space, so
+        # clear it first, unless the caller knows it is already empty.
+        if clear and w != EMPTY:
+            self.send('B,%d,%d,%d,%d\n' % (x, y, z, EMPTY))
+        self.send('B,%d,%d,%d,%d\n' % (x, y, z, w))
+    # Waits until the server has applied everything sent so far. The
+    # server handles a connection's commands in order, and ends its
+    # reply to a chunk request with R,p,q, so asking for chunk (0, 0)
+    # past any block it holds gets back just that line.
+    def sync(self):
+        self.send('C,0,0,%d\n' % SYNC_KEY)
+        self.flush()
+        while True:
+            lines = self.received.split(b'\n')
+            self.received = lines.pop()
+            if b'R,0,0' in lines:
+                return
+            data = self.conn.recv(1 << 16)
+            if not data:
+                raise Exception('Connection closed before sync.')
+            self.received += data
+    def set_blocks(self, blocks, w, clear=True, order=None):
+        # Shapes from voxels.py already stream chunk by chunk; sorting
+        # them would materialise every block.
+        if order is not None or not getattr(blocks, 'ordered', False):
+            blocks = (order or self.order)(blocks)
+        for x, y, z in blocks:
+            self.set_block(x, y, z, w, clear)
+        self.flush()
     def bitmap(self, sx, sy, sz, d1, d2, data, lookup):
-        x, y, z = sx, sy, sz
-        dx1, dy1, dz1 = d1
-        dx2, dy2, dz2 = d2
-        for row in data:
-            x = sx if dx1 else x
-            y = sy if dy1 else y
-            z = sz if dz1 else z
-            for c in row:
-                w = lookup.get(c)
-                if w is not None:
-                    self.set_block(x, y, z, w)
-                x, y, z = x + dx1, y + dy1, z + dz1
-            x, y, z = x + dx2, y + dy2, z + dz2
+        for (x, y, z), w in bitmap_blocks(sx, sy, sz, d1, d2, data, lookup):
+            self.set_block(x, y, z, w)
+        self.flush()
+    # Draws each frame of data in turn, sending only the blocks that
+    # changed since the frame before. Frames are due on a fixed clock
+    # from the start, so time spent sending comes out of the wait rather
+    # than adding to it, and a late frame is sent at once. Returns the
+    # frames per second achieved.
+    def animate(self, sx, sy, sz, d1, d2, frames, lookup, fps=10):
+        shown = {}
+        count = 0
+        start = time.perf_counter()
+        for frame in frames:
+            for block, w in bitmap_blocks(sx, sy, sz, d1, d2, frame, lookup):
+                before = shown.get(block)
+                if before != w:
+                    x, y, z = block
+                    self.set_block(x, y, z, w, clear=before != EMPTY)
+                    shown[block] = w
+            self.flush()
+            count += 1
+            delay = start + count / fps - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        return count / (time.perf_counter() - start)
+
+# The blocks of a bitmap as ((x, y, z), w), stepping d1 along a row and
+# d2 between rows. Characters missing from lookup are left as they are.
+def bitmap_blocks(sx, sy, sz, d1, d2, data, lookup):
+    x, y, z = sx, sy, sz
+    dx1, dy1, dz1 = d1
+    dx2, dy2, dz2 = d2
+    for row in data:
+        x = sx if dx1 else x
+        y = sy if dy1 else y
+        z = sz if dz1 else z
+        for c in row:
+            w = lookup.get(c)
+            if w is not None:
+                yield (x, y, z), w
+            x, y, z = x + dx1, y + dy1, z + dz1
+        x, y, z = x + dx2, y + dy2, z + dz2
 
+# Writes blocks over several connections at once. Blocks are sharded by
+# chunk, so both writes for a block, and every block in a chunk, go down
+# the same connection in order. Each connection waits for its socket
+# buffer to drain before queueing more, and anything the server sends
+# back is read and discarded so that it never stalls on a full buffer.
+class AsyncClient(object):
+    def __init__(self, host, port, connections=4, buffer_size=BUFFER_SIZE,
+                 order=order_layers):
+        self.host = host
+        self.port = port
+        self.connections = connections
+        self.buffer_size = buffer_size
+        self.order = order
+        self.streams = []
+        self.readers = []
+        self.synced = []
+    async def __aenter__(self):
+        await self.connect()
+        return self
+    async def __aexit__(self, *args):
+        await self.close()
+    async def connect(self):
+        for _ in range(self.connections):
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+            writer.write(('A,%s,%s\n' % ("x", 1)).encode())
+            synced = asyncio.Queue()
+            self.streams.append(writer)
+            self.synced.append(synced)
+            self.readers.append(asyncio.ensure_future(self.discard(reader, synced)))
+    # Reads and drops what the server sends, noting each R,0,0 that
+    # answers a sync.
+    async def discard(self, reader, synced):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if line == b'R,0,0\n':
+                synced.put_nowait(None)
+    # Waits until the server has applied everything sent so far on every
+    # connection; see Client.sync.
+    async def sync(self):
+        for writer in self.streams:
+            writer.write(('C,0,0,%d\n' % SYNC_KEY).encode())
+        for synced in self.synced:
+            await synced.get()
+    async def close(self):
+        for writer in self.streams:
+            writer.close()
+        for writer in self.streams:
+            await writer.wait_closed()
+        for reader in self.readers:
+            reader.cancel()
+        self.streams = []
+        self.readers = []
+        self.synced = []
+    # Each connection's shard is put in order on its own; as with
+    # Client.set_blocks, shapes that already stream in order are left be.
+    async def set_blocks(self, blocks, w, clear=True, progress=None, order=None):
+        if order is None and not getattr(blocks, 'ordered', False):
+            order = self.order
+        shards = [[] for _ in self.streams]
+        for x, y, z in blocks:
+            shard = hash((chunked(x), chunked(z))) % len(shards)
+            shards[shard].append((x, y, z))
+        if order is not None:
+            shards = [order(shard) for shard in shards]
+        total = sum(len(shard) for shard in shards)
+        sent = [0]
+        def report(n):
+            sent[0] += n
+            if progress is not None:
+                progress(sent[0], total)
+        await asyncio.gather(*[
+            self.send_blocks(writer, shard, w, clear, report)
+            for writer, shard in zip(self.streams, shards)
+        ])
+    async def send_blocks(self, writer, blocks, w, clear, report):
+        lines = []
+        buffered = 0
+        pending = 0
+        for x, y, z in blocks:
+            if clear and w != EMPTY:
+                line = 'B,%d,%d,%d,%d\n' % (x, y, z, EMPTY)
+                lines.append(line)
+                buffered += len(line)
+            line = 'B,%d,%d,%d,%d\n' % (x, y, z, w)
+            lines.append(line)
+            buffered += len(line)
+            pending += 1
+            if buffered >= self.buffer_size:
+                writer.write(''.join(lines).encode())
+                await writer.drain()
+                report(pending)
+                lines, buffered, pending = [], 0, 0
+        writer.write(''.join(lines).encode())
+        await writer.drain()
+        report(pending)
+
+def test_shapes_match_loops():
+    if numpy is None:
+        return
+    for r in range(6):
+        for fill in (False, True):
+            assert sphere(1, 2, -3, r, fill) == sphere_loop(1, 2, -3, r, fill)
+            for circle, flags in ((circle_x, (1, 0, 0)), (circle_y, (0, 1, 0)), (circle_z, (0, 0, 1))):
+                assert circle(-1, 0, 33, r, fill) == sphere_loop(-1, 0, 33, r, fill, *flags)
+            expected = set()
+            for i in range(-2, 3):
+                expected |= sphere_loop(i, 5, 6, r, fill, fx=True)
+            assert cylinder_x(2, -2, 5, 6, r, fill) == expected
+            expected = set()
+            for i in range(-2, 3):
+                expected |= sphere_loop(4, i, 6, r, fill, fy=True)
+            assert cylinder_y(4, -2, 2, 6, r, fill) == expected
+            expected = set()
+            for i in range(-2, 3):
+                expected |= sphere_loop(4, 5, i, r, fill, fz=True)
+            assert cylinder_z(4, 5, 2, -2, r, fill) == expected
+
+def test_cuboid_matches_loop():
+    if numpy is None:
+        return
+    for bounds in [(0, 0, 0, 0, 0, 0), (0, 3, 0, 0, 0, 3), (3, -1, 0, 1, 2, 5), (-2, 2, -2, 2, -2, 2)]:
+        for fill in (False, True):
+            points = cuboid_array(*bounds, fill=fill)
+            assert len(points) == len(to_set(points))
+            assert cuboid(*bounds, fill=fill) == cuboid_loop(*bounds, fill=fill)
+
+def test_orders_keep_every_block():
+    blocks = sphere_loop(0, 40, 0, 5)
+    for order in ORDERS.values():
+        assert sorted(order(blocks)) == sorted(blocks)
+
+def print_progress(sent, total):
+    sys.stderr.write('\r%d/%d blocks' % (sent, total))
+    if sent == total:
+        sys.stderr.write('\n')
+
+def print_summary(client):
+    sys.stderr.write('%d blocks sent, %d skipped as unchanged\n' % (
+        client.sent, client.skipped,
+    ))
+
+# builder.py [host [port [craft.db]]]; given a database, only blocks
+# that differ from it are sent.
 def get_client():
-    default_args = [DEFAULT_HOST, DEFAULT_PORT]
+    default_args = [DEFAULT_HOST, DEFAULT_PORT, None]
     args = sys.argv[1:] + [None] * len(default_args)
-    host, port = [a or b for a, b in zip(args, default_args)]
-    client = Client(host, int(port))
+    host, port, path = [a or b for a, b in zip(args, default_args)]
+    world = World(path) if path else None
+    client = Client(host, int(port), world=world)
     return client
 
 def main():
-    client = get_client()
+    with get_client() as client:
+        build(client)
+    print_summary(client)
+
+def build(client):
     set_block = client.set_block
     set_blocks = client.set_blocks
     # set_blocks(circle_y(0, 32, 0, 16, True), STONE)
@@ -272,13 +692,13 @@ def main():
         'Y': SAND,
         'W': LIGHT_STONE,
     }
-    for x in range(0, len(data2) * 2):
-        data3 = [
-            row[x:x+len(data[0])]
-            for row in data2
-        ]
-        client.bitmap(0, 64, 32, (1, 0, 0), (0, -1, 0), data3, lookup)
-        time.sleep(0.1)
+    frames = (
+        [row[x:x+len(data[0])] for row in data2]
+        for x in range(0, len(data2) * 2)
+    )
+    fps = client.animate(0, 64, 32, (1, 0, 0), (0, -1, 0), frames, lookup)
+    if fps is not None:
+        sys.stderr.write('%.1f frames/s\n' % fps)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,167 @@
+import argparse
+import asyncio
+import sys
+import threading
+
+import builder
+import writer
+
+# Stands in for the Craft server, speaking enough of its line protocol
+# to test builder.py and mover.py without one: A (authenticate) is
+# accepted and B (block) writes are applied to an in-memory world, with
+# the real server's rule that a block can only be placed in an empty
+# space and only a non-empty space can be emptied. C (chunk) is answered
+# with just the R (redraw) that ends a chunk reply, which clients use to
+# wait until the writes sent before it have been applied. Given a
+# path, the world starts from that database and accepted writes are
+# stored back into it, as the real server would, by the time a C is
+# answered or the connection closes.
+class FakeServer(object):
+    def __init__(self, path=None):
+        self.blocks = {}
+        self.commands = 0
+        self.rejected = 0
+        self.server = None
+        self.world = builder.World(path) if path else None
+        self.writer = writer.Writer(path) if path else None
+
+    async def start(self, host='127.0.0.1', port=0):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        self.host, self.port = self.server.sockets[0].getsockname()[:2]
+        return self
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            reply = self.on_line(line.decode().rstrip('\n'))
+            if reply:
+                writer.write(reply.encode())
+        if self.writer is not None:
+            self.writer.flush()
+        writer.close()
+
+    def on_line(self, line):
+        self.commands += 1
+        args = line.split(',')
+        if args[0] == 'B':
+            self.on_block(*map(int, args[1:5]))
+        elif args[0] == 'C':
+            if self.writer is not None:
+                self.writer.flush()
+            return 'R,%s,%s\n' % (args[1], args[2])
+
+    def on_block(self, x, y, z, w):
+        previous = self.blocks.get((x, y, z))
+        if previous is None and self.world is not None:
+            previous = self.world.get(x, y, z)
+        # There is no terrain here, so a block with no row is empty.
+        if previous is None:
+            previous = 0
+        if (w and previous) or (not w and not previous):
+            self.rejected += 1
+            return
+        self.blocks[(x, y, z)] = w
+        if self.writer is not None:
+            self.writer.set_block(x, y, z, w)
+
+# Runs a FakeServer on an event loop of its own in a daemon thread, for
+# blocking clients in the calling thread. The server is made on that
+# thread too, since its database connections can only be used there.
+def start_thread(path=None, host='127.0.0.1', port=0):
+    async def start():
+        return await FakeServer(path).start(host, port)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever)
+    thread.daemon = True
+    thread.start()
+    return asyncio.run_coroutine_threadsafe(start(), loop).result()
+
+def test_client_dedups_and_syncs():
+    server = start_thread()
+    blocks = builder.cuboid(0, 3, 10, 12, 30, 33)
+    with builder.Client(server.host, server.port, dedup=True) as client:
+        client.set_blocks(blocks, builder.STONE)
+        client.sync()
+        assert server.blocks == {block: builder.STONE for block in blocks}
+        # Nothing is known of the world, so each block is cleared first,
+        # which the server refuses for a space that is already empty.
+        assert server.rejected == len(blocks)
+        client.set_blocks(blocks, builder.STONE)
+        top = [(x, y, z) for x, y, z in blocks if y == 12]
+        client.set_blocks(top, builder.BRICK)
+        client.sync()
+        assert (client.sent, client.skipped) == (len(blocks) + len(top), len(blocks))
+    assert server.rejected == len(blocks)
+    assert all(server.blocks[block] == builder.BRICK for block in top)
+
+def test_client_skips_what_the_database_holds(tmp_path):
+    path = str(tmp_path / 'craft.db')
+    with writer.Writer(path) as db:
+        db.set_block(0, 1, 0, builder.STONE)
+        db.set_block(1, 1, 0, builder.EMPTY)
+    server = start_thread(path)
+    world = builder.World(path)
+    with builder.Client(server.host, server.port, world=world) as client:
+        client.set_block(0, 1, 0, builder.STONE)
+        client.set_block(1, 1, 0, builder.EMPTY)
+        client.set_block(1, 1, 0, builder.BRICK)
+        # No row is not known to be empty, so this is cleared first.
+        client.set_block(2, 1, 0, builder.STONE)
+        client.sync()
+        assert (client.sent, client.skipped) == (2, 2)
+    assert server.blocks == {(1, 1, 0): builder.BRICK, (2, 1, 0): builder.STONE}
+    assert server.rejected == 1
+
+def test_async_client_syncs_every_connection():
+    server = start_thread()
+    blocks = builder.sphere_loop(0, 40, 0, 6)
+    async def run():
+        async with builder.AsyncClient(server.host, server.port, 3) as client:
+            await client.set_blocks(blocks, builder.STONE)
+            await client.sync()
+            assert server.blocks == {block: builder.STONE for block in blocks}
+            await client.set_blocks(blocks, builder.EMPTY)
+            await client.sync()
+            assert set(server.blocks.values()) == {builder.EMPTY}
+    asyncio.run(run())
+
+def test_async_client_orders_each_shard():
+    server = start_thread()
+    blocks = builder.cuboid(-40, 40, 1, 2, -40, 40)
+    shards = []
+    def order(shard):
+        shards.append(shard)
+        return builder.order_chunks(shard)
+    async def run():
+        async with builder.AsyncClient(server.host, server.port, 3, order=order) as client:
+            await client.set_blocks(blocks, builder.STONE)
+            await client.sync()
+    asyncio.run(run())
+    assert len(shards) == 3
+    assert sorted(block for shard in shards for block in shard) == sorted(blocks)
+    assert server.blocks == {block: builder.STONE for block in blocks}
+
+async def serve(host, port, path):
+    server = await FakeServer(path).start(host, port)
+    print('listening on %s:%d' % (server.host, server.port))
+    await server.server.serve_forever()
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=4080)
+    parser.add_argument(
+        '--db',
+        help='a Craft database to start from and write to (default: in memory)',
+    )
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    asyncio.run(serve(args.host, args.port, args.db))
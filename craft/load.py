@@ -0,0 +1,111 @@
+# Load test for the client paths: sends batches of block writes through
+# each path, waiting after every batch for the server to apply it, and
+# reports commands per second and percentiles of the time each batch
+# takes. Runs against a FakeServer unless given a real server.
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+
+import builder
+import fake_server
+
+def random_batches(blocks, batch, seed=0):
+    rng = random.Random(seed)
+    for start in range(0, blocks, batch):
+        yield [
+            (rng.randrange(-256, 256), rng.randrange(1, 128), rng.randrange(-256, 256))
+            for _ in range(min(batch, blocks - start))
+        ]
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+# Each runner sends the batches and returns the seconds each one took,
+# from starting to send it until the server had applied it.
+def run_client(host, port, batches, **kwargs):
+    latencies = []
+    with builder.Client(host, port, **kwargs) as client:
+        for blocks in batches:
+            start = time.perf_counter()
+            client.set_blocks(blocks, builder.STONE)
+            client.sync()
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+def run_async(host, port, batches, connections):
+    async def run():
+        latencies = []
+        async with builder.AsyncClient(host, port, connections) as client:
+            for blocks in batches:
+                start = time.perf_counter()
+                await client.set_blocks(blocks, builder.STONE)
+                await client.sync()
+                latencies.append(time.perf_counter() - start)
+        return latencies
+    return asyncio.run(run())
+
+PATHS = {
+    'unbuffered': lambda host, port, batches, connections: run_client(
+        host, port, batches, buffer_size=0,
+    ),
+    'buffered': lambda host, port, batches, connections: run_client(
+        host, port, batches,
+    ),
+    'async': run_async,
+}
+
+def load(host, port, paths, blocks, batch, connections):
+    print('%-12s %12s %10s %10s %10s' % (
+        'path', 'commands/s', 'p50', 'p90', 'p99',
+    ))
+    for name in paths:
+        batches = list(random_batches(blocks, batch))
+        start = time.perf_counter()
+        latencies = PATHS[name](host, port, batches, connections)
+        elapsed = time.perf_counter() - start
+        # An EMPTY write and a block write for each block.
+        commands = 2 * blocks
+        print('%-12s %12.0f %9.1fms %9.1fms %9.1fms' % (
+            name,
+            commands / elapsed,
+            percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.9) * 1000,
+            percentile(latencies, 0.99) * 1000,
+        ))
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--host',
+        help='a Craft server to load (default: a FakeServer)',
+    )
+    parser.add_argument('--port', type=int, default=builder.DEFAULT_PORT)
+    parser.add_argument(
+        '--db',
+        help='a database for the FakeServer to write to (default: in memory)',
+    )
+    parser.add_argument(
+        '--paths',
+        nargs='+',
+        choices=sorted(PATHS),
+        default=['unbuffered', 'buffered', 'async'],
+    )
+    parser.add_argument('--blocks', type=int, default=100000)
+    parser.add_argument('--batch', type=int, default=1000)
+    parser.add_argument('--connections', type=int, default=4)
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parse_args(argv)
+    host, port = args.host, args.port
+    if host is None:
+        server = fake_server.start_thread(args.db)
+        host, port = server.host, server.port
+    load(host, port, args.paths, args.blocks, args.batch, args.connections)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
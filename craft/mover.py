@@ -1,26 +1,153 @@
+import argparse
 import sqlite3
-import socket
+import sys
+
+import builder
+from builder import chunked
 
 DB_PATH = "craft.db"
 
-db = sqlite3.connect(DB_PATH)
-
-game = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-game.connect(("localhost", 4080))
-game.sendall('A,%s,%s\n' % ("x", 1))
-
-blocks = list(db.execute(
-    """
-    select * from block
-    where x between 31 and 36
-    and z between 0 and 5
-    and w <> 0;"""))
-
-for p, q, x, y, z, w in blocks:
-    print x, y, z
-    game.sendall('B,%s,%s,%s,%s\n' % (x + 20, y, z, w))
-    game.sendall('B,%s,%s,%s,%s\n' % (x + 40, y, z, w))
-    game.sendall('B,%s,%s,%s,%s\n' % (x + 20, y, z + 20, w))
-    game.sendall('B,%s,%s,%s,%s\n' % (x + 40, y, z + 20, w))
-#    for height in range(0, 50):
-#    game.sendall('B,%s,%s,%s,%s\n' % (x + 5, y, z, w))
+# The region with each pair of bounds in order, so that either corner
+# can be given first, as with the shapes in builder.
+def ordered(region):
+    x1, x2, y1, y2, z1, z2 = region
+    return sorted((x1, x2)) + sorted((y1, y2)) + sorted((z1, z2))
+
+# The blocks of a region, x1..x2, y1..y2, z1..z2 inclusive, read one
+# covering chunk at a time through the (p, q) prefix of the block index,
+# so only those chunks are scanned and nothing is held in memory. Rows
+# with w < 0 are copies the server keeps for neighbouring chunks, and
+# w = 0 marks a block that was removed, so both are left out.
+def read_region(db, region):
+    x1, x2, y1, y2, z1, z2 = ordered(region)
+    query = """
+        select x, y, z, w from block
+        where p = ? and q = ?
+        and x between ? and ?
+        and y between ? and ?
+        and z between ? and ?
+        and w > 0;"""
+    for p in range(chunked(x1), chunked(x2) + 1):
+        for q in range(chunked(z1), chunked(z2) + 1):
+            for row in db.execute(query, (p, q, x1, x2, y1, y2, z1, z2)):
+                yield row
+
+# Maps a block to its place relative to the region's low corner after
+# mirroring and then turning the region a quarter at a time about the
+# y axis. The result still has its low corner at (0, 0, 0).
+def transform(region, turns=0, mirror_x=False, mirror_z=False):
+    x1, x2, y1, y2, z1, z2 = ordered(region)
+    width, depth = x2 - x1, z2 - z1
+    def f(x, y, z):
+        x, y, z = x - x1, y - y1, z - z1
+        if mirror_x:
+            x = width - x
+        if mirror_z:
+            z = depth - z
+        w, d = width, depth
+        for _ in range(turns % 4):
+            x, z = d - z, x
+            w, d = d, w
+        return x, y, z
+    return f
+
+# Copies a region to the low corner of the region plus each offset.
+def clone(client, db, region, offsets, turns=0, mirror_x=False, mirror_z=False, clear=True):
+    x1, _, y1, _, z1, _ = ordered(region)
+    f = transform(region, turns, mirror_x, mirror_z)
+    blocks = 0
+    for x, y, z, w in read_region(db, region):
+        x, y, z = f(x, y, z)
+        for dx, dy, dz in offsets:
+            client.set_block(x1 + dx + x, y1 + dy + y, z1 + dz + z, w, clear)
+        blocks += 1
+    client.flush()
+    return blocks
+
+def test_transform_turns_and_mirrors_about_the_low_corner():
+    region = (10, 13, 5, 6, 20, 21)
+    blocks = [
+        (x, y, z)
+        for x in range(10, 14) for y in range(5, 7) for z in range(20, 22)
+    ]
+    f = transform(region)
+    assert f(10, 5, 20) == (0, 0, 0)
+    assert f(13, 6, 21) == (3, 1, 1)
+    turned = transform(region, turns=1)
+    assert turned(10, 5, 20) == (1, 0, 0)
+    assert turned(13, 5, 20) == (1, 0, 3)
+    assert sorted(turned(*block) for block in blocks) == [
+        (x, y, z) for x in range(2) for y in range(2) for z in range(4)
+    ]
+    for block in blocks:
+        assert transform(region, turns=4)(*block) == f(*block)
+        assert transform(region, turns=-1)(*block) == transform(region, turns=3)(*block)
+        assert transform(region, turns=2)(*block) == transform(
+            region, mirror_x=True, mirror_z=True,
+        )(*block)
+    assert transform(region, mirror_x=True)(10, 5, 20) == (3, 0, 0)
+    assert transform(region, mirror_z=True)(10, 5, 20) == (0, 0, 1)
+    assert transform((13, 10, 6, 5, 21, 20), turns=1)(13, 5, 20) == (1, 0, 3)
+
+def parse_offset(text):
+    dx, dy, dz = [int(n) for n in text.split(",")]
+    return dx, dy, dz
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="copy a region of a Craft world to other places",
+    )
+    parser.add_argument(
+        "region",
+        type=int,
+        nargs=6,
+        metavar=("X1", "X2", "Y1", "Y2", "Z1", "Z2"),
+        help="the blocks to copy, bounds inclusive",
+    )
+    parser.add_argument(
+        "-o",
+        "--offset",
+        type=parse_offset,
+        action="append",
+        required=True,
+        help="dx,dy,dz from the region to a copy; repeat for more copies",
+    )
+    parser.add_argument(
+        "--rotate",
+        type=int,
+        choices=[0, 90, 180, 270],
+        default=0,
+        help="degrees to turn each copy about the y axis",
+    )
+    parser.add_argument("--mirror-x", action="store_true")
+    parser.add_argument("--mirror-z", action="store_true")
+    parser.add_argument(
+        "--no-clear",
+        action="store_true",
+        help="skip the EMPTY write when every target block is empty",
+    )
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--host", default=builder.DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=builder.DEFAULT_PORT)
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parse_args(argv)
+    db = sqlite3.connect(args.db)
+    with builder.Client(args.host, args.port) as client:
+        blocks = clone(
+            client,
+            db,
+            args.region,
+            args.offset,
+            args.rotate // 90,
+            args.mirror_x,
+            args.mirror_z,
+            not args.no_clear,
+        )
+    sys.stderr.write("%d blocks copied to %d places\n" % (
+        blocks, len(args.offset),
+    ))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,290 @@
+# Compact shapes for builder.py. A shape is stored chunk by chunk: each
+# 32x32x32 cube of a Craft chunk column is one Python int used as a
+# 32768-bit mask, so a dense cube costs 4 KiB rather than a set entry
+# and a tuple per block. Union (|), difference (-) and intersection (&)
+# build lazy expressions that are evaluated one cube at a time, and
+# iterating any shape streams its blocks cube by cube, bottom up.
+
+import builder
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+BITS = 5
+SIZE = 1 << BITS
+CUBE_BITS = SIZE ** 3
+BATCH = 1 << 20
+
+assert SIZE == builder.CHUNK_SIZE
+
+def key(x, y, z):
+    return x >> BITS, z >> BITS, y >> BITS
+
+def bit(x, y, z):
+    return ((y & (SIZE - 1)) << (2 * BITS)) | ((z & (SIZE - 1)) << BITS) | (x & (SIZE - 1))
+
+class Shape(object):
+    # Already streams in build order, so Client.set_blocks need not sort.
+    ordered = True
+
+    def keys(self):
+        raise NotImplementedError
+
+    def mask(self, key):
+        raise NotImplementedError
+
+    def __or__(self, other):
+        return Union(self, as_shape(other))
+
+    def __sub__(self, other):
+        return Difference(self, as_shape(other))
+
+    def __and__(self, other):
+        return Intersection(self, as_shape(other))
+
+    def __iter__(self):
+        for k in sorted(self.keys()):
+            mask = self.mask(k)
+            if mask:
+                for block in blocks_in(k, mask):
+                    yield block
+
+    def __len__(self):
+        return sum(bin(self.mask(k)).count('1') for k in self.keys())
+
+    def __contains__(self, block):
+        return bool(self.mask(key(*block)) >> bit(*block) & 1)
+
+    def materialize(self):
+        result = Voxels()
+        for k in self.keys():
+            mask = self.mask(k)
+            if mask:
+                result.chunks[k] = mask
+        return result
+
+class Voxels(Shape):
+    def __init__(self, chunks=None):
+        self.chunks = chunks or {}
+
+    @classmethod
+    def from_blocks(cls, blocks):
+        result = cls()
+        for x, y, z in blocks:
+            result.add(x, y, z)
+        return result
+
+    # From an (n, 3) array of coordinates, grouping them by cube and
+    # packing each cube's bits in one go.
+    @classmethod
+    def from_array(cls, points):
+        points = numpy.asarray(points, dtype=numpy.int64).reshape(-1, 3)
+        if len(points) == 0:
+            return cls()
+        x, y, z = points[:, 0], points[:, 1], points[:, 2]
+        keys = numpy.column_stack((x >> BITS, z >> BITS, y >> BITS))
+        bits = (
+            ((y & (SIZE - 1)) << (2 * BITS)) |
+            ((z & (SIZE - 1)) << BITS) |
+            (x & (SIZE - 1))
+        )
+        order = numpy.lexsort((keys[:, 2], keys[:, 1], keys[:, 0]))
+        keys, bits = keys[order], bits[order]
+        starts = numpy.flatnonzero(
+            numpy.concatenate(([True], (keys[1:] != keys[:-1]).any(axis=1)))
+        )
+        ends = numpy.append(starts[1:], len(keys))
+        chunks = {}
+        for start, end in zip(starts, ends):
+            flags = numpy.zeros(CUBE_BITS, dtype=bool)
+            flags[bits[start:end]] = True
+            packed = numpy.packbits(flags, bitorder='little').tobytes()
+            chunks[tuple(keys[start].tolist())] = int.from_bytes(packed, 'little')
+        return cls(chunks)
+
+    # Packs an iterable of arrays, a batch of roughly BATCH points at a
+    # time, so that each cube is packed as few times as possible.
+    @classmethod
+    def from_slabs(cls, slabs):
+        result = cls()
+        batch = []
+        size = 0
+        for slab in slabs:
+            batch.append(slab)
+            size += len(slab)
+            if size >= BATCH:
+                result.update(cls.from_array(numpy.concatenate(batch)))
+                batch = []
+                size = 0
+        if batch:
+            result.update(cls.from_array(numpy.concatenate(batch)))
+        return result
+
+    def update(self, other):
+        for k in other.keys():
+            self.chunks[k] = self.chunks.get(k, 0) | other.mask(k)
+
+    def add(self, x, y, z):
+        k = key(x, y, z)
+        self.chunks[k] = self.chunks.get(k, 0) | (1 << bit(x, y, z))
+
+    def keys(self):
+        return self.chunks.keys()
+
+    def mask(self, key):
+        return self.chunks.get(key, 0)
+
+class Union(Shape):
+    def __init__(self, left, right):
+        self.left, self.right = left, right
+
+    def keys(self):
+        return set(self.left.keys()) | set(self.right.keys())
+
+    def mask(self, key):
+        return self.left.mask(key) | self.right.mask(key)
+
+class Difference(Shape):
+    def __init__(self, left, right):
+        self.left, self.right = left, right
+
+    def keys(self):
+        return self.left.keys()
+
+    def mask(self, key):
+        left = self.left.mask(key)
+        return left and left & ~self.right.mask(key)
+
+class Intersection(Shape):
+    def __init__(self, left, right):
+        self.left, self.right = left, right
+
+    def keys(self):
+        return set(self.left.keys()) & set(self.right.keys())
+
+    def mask(self, key):
+        return self.left.mask(key) & self.right.mask(key)
+
+def as_shape(blocks):
+    if isinstance(blocks, Shape):
+        return blocks
+    return Voxels.from_blocks(blocks)
+
+def blocks_in(k, mask):
+    p, q, k = k
+    if numpy is not None:
+        flags = numpy.unpackbits(
+            numpy.frombuffer(mask.to_bytes(CUBE_BITS // 8, 'little'), numpy.uint8),
+            bitorder='little',
+        )
+        index = numpy.flatnonzero(flags)
+        xs = (p << BITS) + (index & (SIZE - 1))
+        zs = (q << BITS) + ((index >> BITS) & (SIZE - 1))
+        ys = (k << BITS) + (index >> (2 * BITS))
+        return zip(xs.tolist(), ys.tolist(), zs.tolist())
+    return (
+        (
+            (p << BITS) + (index & (SIZE - 1)),
+            (k << BITS) + (index >> (2 * BITS)),
+            (q << BITS) + ((index >> BITS) & (SIZE - 1)),
+        )
+        for index, flag in enumerate(bin(mask)[:1:-1])
+        if flag == '1'
+    )
+
+# The shapes of builder.py, as Voxels. With NumPy they are packed from
+# coordinate arrays a slab at a time, so the whole shape never exists as
+# a set or even as one array.
+def from_shape(slabs, set_shape):
+    if numpy is None:
+        return Voxels.from_blocks(set_shape())
+    return Voxels.from_slabs(slabs())
+
+def sphere(cx, cy, cz, r, fill=False, fx=False, fy=False, fz=False):
+    args = cx, cy, cz, r, fill, fx, fy, fz
+    return from_shape(
+        lambda: builder.sphere_slabs(*args),
+        lambda: builder.sphere(*args),
+    )
+
+def circle_x(x, y, z, r, fill=False):
+    return sphere(x, y, z, r, fill, fx=True)
+
+def circle_y(x, y, z, r, fill=False):
+    return sphere(x, y, z, r, fill, fy=True)
+
+def circle_z(x, y, z, r, fill=False):
+    return sphere(x, y, z, r, fill, fz=True)
+
+def extrude_slabs(points, axis, length):
+    for step in range(length + 1):
+        slab = points.copy()
+        slab[:, axis] += step
+        yield slab
+
+def cylinder_x(x1, x2, y, z, r, fill=False):
+    x1, x2 = sorted((x1, x2))
+    return from_shape(
+        lambda: extrude_slabs(builder.circle_x_array(x1, y, z, r, fill), 0, x2 - x1),
+        lambda: builder.cylinder_x(x1, x2, y, z, r, fill),
+    )
+
+def cylinder_y(x, y1, y2, z, r, fill=False):
+    y1, y2 = sorted((y1, y2))
+    return from_shape(
+        lambda: extrude_slabs(builder.circle_y_array(x, y1, z, r, fill), 1, y2 - y1),
+        lambda: builder.cylinder_y(x, y1, y2, z, r, fill),
+    )
+
+def cylinder_z(x, y, z1, z2, r, fill=False):
+    z1, z2 = sorted((z1, z2))
+    return from_shape(
+        lambda: extrude_slabs(builder.circle_z_array(x, y, z1, r, fill), 2, z2 - z1),
+        lambda: builder.cylinder_z(x, y, z1, z2, r, fill),
+    )
+
+# A hollow cuboid is only its faces, so only a filled one is sliced.
+def cuboid(x1, x2, y1, y2, z1, z2, fill=True):
+    x1, x2 = sorted((x1, x2))
+    if fill:
+        slabs = lambda: (
+            builder.cuboid_array(x, x, y1, y2, z1, z2)
+            for x in range(x1, x2 + 1)
+        )
+    else:
+        slabs = lambda: [builder.cuboid_array(x1, x2, y1, y2, z1, z2, fill)]
+    return from_shape(
+        slabs,
+        lambda: builder.cuboid(x1, x2, y1, y2, z1, z2, fill),
+    )
+
+def test_algebra_matches_sets():
+    a = builder.sphere(0, 20, 0, 12, True)
+    b = builder.cuboid(-40, 3, 10, 40, -5, 33)
+    for left, right in [(a, b), (a, set()), (set(), b), (set(), set())]:
+        shapes = as_shape(left), as_shape(right)
+        for op in ('__or__', '__sub__', '__and__'):
+            shape = getattr(shapes[0], op)(shapes[1])
+            expected = getattr(left, op)(right)
+            assert set(shape) == expected
+            assert len(shape) == len(expected)
+            assert len(list(shape)) == len(expected)
+            assert set(shape.materialize()) == expected
+        assert all(block in shapes[0] for block in left)
+
+def test_shapes_match_builder():
+    for r in range(5):
+        assert set(sphere(1, 40, -1, r)) == builder.sphere(1, 40, -1, r)
+        assert set(circle_y(-33, 0, 0, r, True)) == builder.circle_y(-33, 0, 0, r, True)
+        assert set(cylinder_x(-3, 3, 8, 8, r)) == builder.cylinder_x(-3, 3, 8, 8, r)
+        assert set(cylinder_y(0, 5, 0, 0, r, True)) == builder.cylinder_y(0, 5, 0, 0, r, True)
+        assert set(cylinder_z(0, 0, -5, 5, r)) == builder.cylinder_z(0, 0, -5, 5, r)
+    for fill in (False, True):
+        assert set(cuboid(-3, 40, 2, 4, 35, 30, fill)) == builder.cuboid(-3, 40, 2, 4, 35, 30, fill)
+
+def test_iteration_is_ordered_by_cube():
+    shape = as_shape(builder.cuboid(-40, 40, 0, 70, 0, 0))
+    keys = [key(*block) for block in shape]
+    assert keys == sorted(keys)
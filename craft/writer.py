@@ -0,0 +1,167 @@
+# Writes blocks straight into a Craft database, for imports too big to
+# send through the server. Only use it on a world the server is not
+# running on: the server keeps chunks in memory and will not see the
+# change until it restarts. A Writer takes the same calls as a Client,
+# so builder.build() can be pointed at either.
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+import builder
+from builder import CHUNK_SIZE, chunked
+
+BATCH_SIZE = 100000
+
+PRAGMAS = [
+    'pragma journal_mode = wal;',
+    'pragma synchronous = normal;',
+    'pragma temp_store = memory;',
+    'pragma cache_size = -65536;',
+]
+
+SCHEMA = [
+    'create table if not exists block ('
+    '    p int not null,'
+    '    q int not null,'
+    '    x int not null,'
+    '    y int not null,'
+    '    z int not null,'
+    '    w int not null'
+    ');',
+    'create unique index if not exists block_pqxyz_idx on'
+    '    block (p, q, x, y, z);',
+    'create table if not exists block_history ('
+    '   timestamp real not null,'
+    '   user_id int not null,'
+    '   x int not null,'
+    '   y int not null,'
+    '   z int not null,'
+    '   w int not null'
+    ');',
+]
+
+INSERT_BLOCK = (
+    'insert or replace into block (p, q, x, y, z, w) '
+    'values (?, ?, ?, ?, ?, ?);'
+)
+
+INSERT_HISTORY = (
+    'insert into block_history (timestamp, user_id, x, y, z, w) '
+    'values (?, ?, ?, ?, ?, ?);'
+)
+
+# The rows the server stores for a block: one in its own chunk, and one
+# with w negated in each neighbouring chunk it borders, which tells
+# clients to rebuild that chunk too. Most blocks border nothing.
+def block_rows(x, y, z, w):
+    p, q = chunked(x), chunked(z)
+    rows = [(p, q, x, y, z, w)]
+    if 0 < x % CHUNK_SIZE < CHUNK_SIZE - 1 and 0 < z % CHUNK_SIZE < CHUNK_SIZE - 1:
+        return rows
+    for dx in range(-1, 2):
+        for dz in range(-1, 2):
+            if dx == 0 and dz == 0:
+                continue
+            if dx and chunked(x + dx) == p:
+                continue
+            if dz and chunked(z + dz) == q:
+                continue
+            rows.append((p + dx, q + dz, x, y, z, -w))
+    return rows
+
+class Writer(object):
+    def __init__(self, path, user_id=0, batch_size=BATCH_SIZE):
+        self.db = sqlite3.connect(path)
+        for pragma in PRAGMAS:
+            self.db.execute(pragma)
+        with self.db:
+            for query in SCHEMA:
+                self.db.execute(query)
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.blocks = []
+        self.history = []
+        self.rows = 0
+        self.now = None
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.flush()
+        self.db.close()
+    # Writes every pending row in one transaction.
+    def flush(self):
+        if self.history:
+            with self.db:
+                self.db.executemany(INSERT_BLOCK, self.blocks)
+                self.db.executemany(INSERT_HISTORY, self.history)
+            self.rows += len(self.blocks)
+            self.blocks = []
+            self.history = []
+        self.now = None
+    # Blocks written in one batch share a timestamp in block_history.
+    def set_block(self, x, y, z, w, clear=True):
+        if self.now is None:
+            self.now = time.time()
+        self.blocks.extend(block_rows(x, y, z, w))
+        self.history.append((self.now, self.user_id, x, y, z, w))
+        if len(self.history) >= self.batch_size:
+            self.flush()
+    def set_blocks(self, blocks, w, clear=True):
+        for x, y, z in blocks:
+            self.set_block(x, y, z, w)
+        self.flush()
+    bitmap = builder.Client.bitmap
+    # A database has no viewer to show the frames between, so only the
+    # last one is written, nothing waits on fps, and there is no frame
+    # rate to report.
+    def animate(self, sx, sy, sz, d1, d2, frames, lookup, fps=10):
+        last = None
+        for frame in frames:
+            last = frame
+        if last is not None:
+            self.bitmap(sx, sy, sz, d1, d2, last, lookup)
+        return None
+
+def test_block_rows_reproduce_craft_db():
+    db = sqlite3.connect(os.path.join(os.path.dirname(__file__), 'craft.db'))
+    rows = set(db.execute('select p, q, x, y, z, w from block;'))
+    expected = set()
+    for p, q, x, y, z, w in rows:
+        if p == chunked(x) and q == chunked(z):
+            expected.update(block_rows(x, y, z, w))
+    assert expected == rows
+
+def test_writer_writes_rows_and_history(tmp_path):
+    path = str(tmp_path / 'craft.db')
+    with Writer(path, user_id=7, batch_size=2) as writer:
+        writer.set_blocks([(0, 1, 0), (31, 1, 5), (40, 2, 40)], builder.STONE)
+        writer.set_block(0, 1, 0, builder.BRICK)
+    db = sqlite3.connect(path)
+    assert sorted(db.execute('select p, q, x, y, z, w from block;')) == sorted(
+        block_rows(0, 1, 0, builder.BRICK) +
+        block_rows(31, 1, 5, builder.STONE) +
+        block_rows(40, 2, 40, builder.STONE)
+    )
+    assert writer.rows == 4 + 2 + 1 + 4
+    assert list(db.execute('select count(*), min(user_id) from block_history;')) == [(4, 7)]
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='run builder.build() straight into a Craft database',
+    )
+    parser.add_argument('path', help='the world, e.g. craft.db')
+    parser.add_argument('--user-id', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parse_args(argv)
+    with Writer(args.path, args.user_id, args.batch_size) as writer:
+        builder.build(writer)
+    sys.stderr.write('%d rows written\n' % writer.rows)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,387 @@
+import argparse
+import json
+import os
+import platform
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bitarray import bitarray
+
+import main
+
+WORDS = (
+    "the of and to in is was for on that with as by at from it an be "
+    "this which or are his had not but were have they one all their "
+    "request response error warning info debug user session timeout"
+).split()
+
+def text_corpus(size, seed=0):
+    rng = random.Random(seed)
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words).encode()[:size]
+
+def binary_corpus(size, seed=0):
+    rng = random.Random(seed)
+    records = []
+    timestamp = 1_600_000_000
+    for _ in range(size // 16 + 1):
+        timestamp += rng.randrange(4)
+        records.append(struct.pack(
+            ">IHHQ",
+            timestamp,
+            rng.randrange(16),
+            rng.choice((200, 200, 200, 404, 500)),
+            rng.randrange(1 << 12),
+        ))
+    return b"".join(records)[:size]
+
+def log_corpus(size, seed=0):
+    rng = random.Random(seed)
+    lines = []
+    length = 0
+    timestamp = 1_600_000_000
+    while length < size:
+        timestamp += rng.randrange(3)
+        line = "{} {} user={} path=/api/{} status={} ms={}\n".format(
+            timestamp,
+            rng.choice(("INFO", "INFO", "INFO", "WARN", "ERROR")),
+            rng.randrange(1000),
+            rng.choice(("users", "orders", "items", "search")),
+            rng.choice((200, 200, 200, 404, 500)),
+            rng.randrange(500),
+        )
+        lines.append(line)
+        length += len(line)
+    return "".join(lines).encode()[:size]
+
+def random_corpus(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+CORPORA = {
+    "text": text_corpus,
+    "log": log_corpus,
+    "binary": binary_corpus,
+    "random": random_corpus,
+}
+
+def throughput(f, arg, size, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f(arg)
+        best = min(best, time.perf_counter() - start)
+    return size / best / 1e6
+
+def bench_decoders(size, repeat):
+    decoders = [
+        ("tree", main.encode, main.decode),
+        ("canonical", main.encode_canonical, main.decode_canonical),
+        ("table", main.encode_canonical, main.decode_canonical_table),
+    ]
+    for corpus_name, corpus in CORPORA.items():
+        data = corpus(size)
+        for name, encoder, decoder in decoders:
+            comp = encoder(data)
+            assert decoder(comp) == data
+            mb_s = throughput(decoder, comp, size, repeat)
+            print("{:8} {:10} {:8.2f} MB/s".format(corpus_name, name, mb_s))
+
+def bench_methods(size, repeat):
+    for corpus_name, corpus in CORPORA.items():
+        data = corpus(size)
+        for name, method in sorted(main.METHOD_NAMES.items()):
+            encoder, decoder = main.CODECS[method]
+            comp = encoder(data)
+            assert decoder(comp) == data
+            print("{:8} {:10} {:6.3f} ratio {:8.2f} MB/s encode {:8.2f} MB/s decode".format(
+                corpus_name,
+                name,
+                comp.nbytes / size,
+                throughput(encoder, data, size, repeat),
+                throughput(decoder, comp, size, repeat),
+            ))
+
+# Runs MAIN as __main__ with the arguments after it, then writes the
+# process's peak RSS to stderr. VmHWM starts again at exec, unlike the
+# ru_maxrss that wait4 reports, which counts what the parent had mapped
+# when it forked.
+PEAK_RSS_WRAPPER = """
+import atexit, runpy, sys
+def report():
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                sys.stderr.write(line)
+atexit.register(report)
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+# Runs the CLI in a child process, returning wall time and peak RSS in KB.
+def run_cli(args, stdin=None, stdout=subprocess.DEVNULL):
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-c", PEAK_RSS_WRAPPER, MAIN] + args,
+        stdin=stdin,
+        stdout=stdout,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    elapsed = time.perf_counter() - start
+    lines = process.stderr.splitlines()
+    sys.stderr.writelines(line + "\n" for line in lines if not line.startswith("VmHWM:"))
+    process.check_returncode()
+    peak = [line for line in lines if line.startswith("VmHWM:")]
+    return elapsed, int(peak[-1].split()[1])
+
+def bench_io(size):
+    with tempfile.TemporaryDirectory() as directory:
+        data_path = os.path.join(directory, "data")
+        comp_path = os.path.join(directory, "comp")
+        out_path = os.path.join(directory, "out")
+        with open(data_path, "wb") as f:
+            for offset in range(0, size, 1 << 20):
+                f.write(text_corpus(min(1 << 20, size - offset), seed=offset))
+        runs = [
+            ("encode stdin", ["encode"], data_path, comp_path),
+            ("encode mmap", ["encode", data_path, "-o", comp_path], None, None),
+            ("decode stdin", ["decode"], comp_path, out_path),
+            ("decode mmap", ["decode", comp_path, "-o", out_path], None, None),
+        ]
+        # The CLI's footprint before it touches any data, which includes
+        # the test dependencies main.py imports.
+        _, startup_rss = run_cli(["--help"])
+        print("{:14} {:>13} {:8} KB peak RSS".format("startup", "", startup_rss))
+        for name, args, stdin_path, stdout_path in runs:
+            with open(stdin_path or os.devnull, "rb") as stdin, \
+                 open(stdout_path or os.devnull, "wb") as stdout:
+                elapsed, max_rss = run_cli(args, stdin, stdout)
+            print("{:14} {:8.2f} MB/s {:8} KB peak RSS".format(
+                name, size / elapsed / 1e6, max_rss,
+            ))
+
+# Reads as size bytes drawn uniformly from 2 ** bits symbols, generated
+# a block at a time so that gigabyte inputs never sit in memory.
+class CorpusStream(object):
+    def __init__(self, size, bits, seed=0):
+        self.remaining = size
+        self.rng = random.Random(seed)
+        self.table = bytes(i & ((1 << bits) - 1) for i in range(256))
+
+    def read(self, n):
+        n = min(n, self.remaining)
+        self.remaining -= n
+        return self.rng.randbytes(n).translate(self.table)
+
+# Best of at least repeat runs, and of enough runs to fill min_seconds,
+# so that small inputs are not at the mercy of a single noisy run.
+def best_time(f, repeat, min_seconds=0.5):
+    best = float("inf")
+    runs = 0
+    total = 0
+    while runs < repeat or total < min_seconds:
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        runs += 1
+        total += elapsed
+    return best
+
+def peak_memory(f):
+    tracemalloc.start()
+    try:
+        f()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def header_bits(method, ba):
+    if method == main.TREE:
+        return 16 + main.ba2int(ba[0:16])
+    contexts, i = main.deserialize_lengths(ba)
+    if method == main.ORDER1:
+        for _ in contexts:
+            _, i = main.deserialize_lengths(ba, i)
+    return i
+
+# Everything in the container that is not payload: block headers, code
+# tables, padding and the block index.
+def overhead_bytes(comp):
+    comp.seek(0, os.SEEK_END)
+    size = comp.tell()
+    comp.seek(0)
+    payload_bits = 0
+    for method, block in main.read_blocks(comp):
+        ba = bitarray(buffer=block)
+        payload_bits += len(main.read_payload(ba, header_bits(method, ba)))
+    return size - payload_bits / 8
+
+def run_case(method, bits, size, repeat):
+    with tempfile.TemporaryFile() as comp:
+        def encode():
+            comp.seek(0)
+            comp.truncate()
+            stream = CorpusStream(size, bits)
+            for chunk in main.encode_stream(stream, method=method):
+                comp.write(chunk)
+
+        def decode():
+            comp.seek(0)
+            for _ in main.decode_stream(comp):
+                pass
+
+        encode_seconds = best_time(encode, repeat)
+        compressed = comp.tell()
+        decode_seconds = best_time(decode, repeat)
+        return {
+            "method": method,
+            "bits": bits,
+            "size": size,
+            "ratio": compressed / size,
+            "overhead_bytes": overhead_bytes(comp),
+            "encode_mb_s": size / encode_seconds / 1e6,
+            "decode_mb_s": size / decode_seconds / 1e6,
+            "encode_peak_bytes": peak_memory(encode),
+            "decode_peak_bytes": peak_memory(decode),
+        }
+
+def case_key(result):
+    return result["method"], result["bits"], result["size"]
+
+# Throughputs more than threshold below the baseline, as messages.
+def regressions(results, baseline, threshold):
+    baseline = {case_key(result): result for result in baseline}
+    messages = []
+    for result in results:
+        before = baseline.get(case_key(result))
+        if before is None:
+            continue
+        for metric in ("encode_mb_s", "decode_mb_s"):
+            if result[metric] < before[metric] * (1 - threshold):
+                messages.append(
+                    "{} bits={} size={}: {} {:.2f} < baseline {:.2f}".format(
+                        result["method"],
+                        result["bits"],
+                        result["size"],
+                        metric,
+                        result[metric],
+                        before[metric],
+                    )
+                )
+    return messages
+
+def bench_suite(sizes, bits, methods, repeat, output, baseline, threshold):
+    results = []
+    for method_name in methods:
+        for entropy in bits:
+            for size in sizes:
+                result = run_case(main.METHOD_NAMES[method_name], entropy, size, repeat)
+                result["method"] = method_name
+                results.append(result)
+                print(
+                    "{:10} {} bits {:>10} B {:6.3f} ratio {:8.0f} B overhead "
+                    "{:7.2f}/{:7.2f} MB/s {:6.1f}/{:6.1f} MB peak".format(
+                        method_name,
+                        entropy,
+                        size,
+                        result["ratio"],
+                        result["overhead_bytes"],
+                        result["encode_mb_s"],
+                        result["decode_mb_s"],
+                        result["encode_peak_bytes"] / 1e6,
+                        result["decode_peak_bytes"] / 1e6,
+                    ),
+                    flush=True,
+                )
+    if output:
+        with open(output, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results,
+            }, f, indent=2)
+    if baseline and os.path.exists(baseline):
+        with open(baseline) as f:
+            messages = regressions(results, json.load(f)["results"], threshold)
+        for message in messages:
+            print("REGRESSION " + message)
+        return not messages
+    return True
+
+def parse_size(text):
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    if text[-1:].upper() in units:
+        return int(text[:-1]) * units[text[-1:].upper()]
+    return int(text)
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="main.py bench")
+    parser.add_argument("bench", choices=["suite", "decoders", "io", "methods"])
+    parser.add_argument("--size", type=parse_size, default=1 << 20)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--sizes",
+        type=parse_size,
+        nargs="+",
+        default=[1 << 10, 1 << 16, 1 << 20],
+        help="input sizes for suite, e.g. 1K 1M 1G",
+    )
+    parser.add_argument("--bits", type=int, nargs="+", default=[2, 4, 6, 8])
+    parser.add_argument(
+        "--methods",
+        nargs="+",
+        choices=sorted(main.METHOD_NAMES),
+        default=sorted(main.METHOD_NAMES),
+    )
+    parser.add_argument("-o", "--output", help="write suite results as JSON")
+    parser.add_argument(
+        "--baseline",
+        default=BASELINE,
+        help="suite results to compare against, from an earlier --output "
+        "on the same machine (default: baseline.json, if present)",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="fail on throughput this fraction below the baseline",
+    )
+    return parser.parse_args(argv)
+
+def run(argv):
+    args = parse_args(argv)
+    if args.bench == "suite":
+        ok = bench_suite(
+            args.sizes,
+            args.bits,
+            args.methods,
+            args.repeat,
+            args.output,
+            args.baseline,
+            args.threshold,
+        )
+        sys.exit(0 if ok else 1)
+    elif args.bench == "decoders":
+        bench_decoders(args.size, args.repeat)
+    elif args.bench == "io":
+        bench_io(args.size)
+    elif args.bench == "methods":
+        bench_methods(args.size, args.repeat)
+
+if __name__ == "__main__":
+    run(sys.argv[1:])
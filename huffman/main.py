@@ -1,9 +1,41 @@
-from bitarray import bitarray
+from bitarray import bitarray, decodetree
 from bitarray.util import int2ba, ba2int
+import argparse
 import collections
+import concurrent.futures
+import contextlib
+import functools
+import heapq
 import hypothesis
+import io
+import itertools
+import mmap
+import os
+import random
 import sys
 
+BLOCK_SIZE = 1 << 20
+
+TREE = 0
+CANONICAL = 1
+ORDER1 = 2
+
+METHOD_NAMES = {
+    "tree": TREE,
+    "canonical": CANONICAL,
+    "order1": ORDER1,
+}
+
+LENGTH_BITS = 6
+ZERO_RUN_BITS = 8
+PEEK_BITS = 12
+ORDER1_PEEK_BITS = 8
+REFILL_BYTES = 32
+
+BLOCK_HEADER_SIZE = 5
+FOOTER_SIZE = 12
+INDEX_MAGIC = b"HIDX"
+
 @hypothesis.given(hypothesis.strategies.binary())
 @hypothesis.example(b"ABCCBAB")
 @hypothesis.example(b"A_DEAD_DAD_CEDED_A_BAD_BABE_A_BEADED_ABACA_BED")
@@ -11,17 +43,189 @@ def test_encode_then_decode_is_identity(b):
     result = decode(encode(b))
     assert result == b, "was: {}".format(result)
 
+@hypothesis.given(hypothesis.strategies.binary())
+@hypothesis.example(b"ABCCBAB")
+@hypothesis.example(bytes(range(256)))
+def test_encode_canonical_then_decode_canonical_is_identity(b):
+    result = decode_canonical(encode_canonical(b))
+    assert result == b, "was: {}".format(result)
+
+@hypothesis.given(hypothesis.strategies.binary())
+def test_encode_canonical_then_decode_canonical_table_is_identity(b):
+    result = decode_canonical_table(encode_canonical(b))
+    assert result == b, "was: {}".format(result)
+
+@hypothesis.given(hypothesis.strategies.binary())
+@hypothesis.example(b"ABCCBAB")
+@hypothesis.example(bytes(range(256)) * 2)
+def test_encode_order1_then_decode_order1_is_identity(b):
+    result = decode_order1(encode_order1(b))
+    assert result == b, "was: {}".format(result)
+
+def test_order1_beats_order0_on_structured_input():
+    b = b"".join(
+        "id={} status=200 path=/api/users\n".format(i).encode()
+        for i in range(1000)
+    )
+    assert len(encode_order1(b)) < len(encode_canonical(b))
+
+def test_canonical_header_is_smaller_than_serialized_dict():
+    b = b"A_DEAD_DAD_CEDED_A_BAD_BABE_A_BEADED_ABACA_BED"
+    assert len(encode_canonical(b)) < len(encode(b))
+
+def test_canonical_codes_are_ordered_by_length_then_symbol():
+    codes = canonical_codes({ord("a"): 2, ord("b"): 1, ord("c"): 3, ord("d"): 3})
+    assert codes == {
+        ord("b"): bitarray("0"),
+        ord("a"): bitarray("10"),
+        ord("c"): bitarray("110"),
+        ord("d"): bitarray("111"),
+    }
+
+@hypothesis.given(
+    hypothesis.strategies.binary(),
+    hypothesis.strategies.integers(min_value=1, max_value=PEEK_BITS),
+)
+def test_decode_table_with_any_peek_width_is_identity(b, peek_bits):
+    lengths = code_lengths(collections.Counter(b))
+    z = bitarray()
+    if b:
+        z.encode(canonical_codes(lengths), b)
+    table = build_decode_table(lengths, peek_bits)
+    result = decode_table(z.tobytes(), len(z), table)
+    assert result == b, "was: {}".format(result)
+
+def test_decode_table_handles_codes_longer_than_peek():
+    counts = {symbol: 2 ** symbol for symbol in range(20)}
+    lengths = code_lengths(counts)
+    assert max(lengths.values()) > PEEK_BITS
+    b = bytes(range(20)) * 3
+    z = bitarray()
+    z.encode(canonical_codes(lengths), b)
+    result = decode_table(z.tobytes(), len(z), build_decode_table(lengths))
+    assert result == b, "was: {}".format(result)
+
+@hypothesis.given(
+    hypothesis.strategies.binary(),
+    hypothesis.strategies.integers(min_value=1, max_value=16),
+    hypothesis.strategies.sampled_from(sorted(METHOD_NAMES.values())),
+)
+def test_encode_stream_then_decode_stream_is_identity(b, block_size, method):
+    comp = b"".join(encode_stream(io.BytesIO(b), block_size, method))
+    result = b"".join(decode_stream(io.BytesIO(comp)))
+    assert result == b, "was: {}".format(result)
+
+def test_decode_stream_rejects_truncated_input():
+    comp = b"".join(encode_stream(io.BytesIO(b"ABCCBAB")))
+    try:
+        b"".join(decode_stream(io.BytesIO(comp[:BLOCK_HEADER_SIZE + 2])))
+    except ValueError:
+        pass
+    else:
+        assert False, "truncated stream was accepted"
+
+@hypothesis.given(hypothesis.strategies.binary())
+def test_decode_stream_of_garbage_fails_cleanly(b):
+    try:
+        b"".join(decode_stream(io.BytesIO(b)))
+    except ValueError:
+        pass
+
+@hypothesis.given(
+    hypothesis.strategies.binary(),
+    hypothesis.strategies.sampled_from(sorted(METHOD_NAMES.values())),
+    hypothesis.strategies.integers(min_value=0),
+    hypothesis.strategies.binary(min_size=1, max_size=4),
+)
+def test_decode_stream_of_corrupted_input_fails_cleanly(b, method, position, noise):
+    comp = bytearray(b"".join(encode_stream(io.BytesIO(b), 16, method)))
+    position %= len(comp)
+    comp[position:position+len(noise)] = noise
+    try:
+        b"".join(decode_stream(io.BytesIO(bytes(comp))))
+    except ValueError:
+        pass
+
+def test_order1_blocks_are_never_larger_than_canonical():
+    rng = random.Random(0)
+    b = rng.randbytes(1 << 12) + b"id=1 status=200 path=/api/users\n" * 200
+    order1 = b"".join(encode_stream(io.BytesIO(b), 1 << 12, ORDER1))
+    canonical = b"".join(encode_stream(io.BytesIO(b), 1 << 12, CANONICAL))
+    assert len(order1) < len(canonical)
+    methods = [method for method, _ in read_blocks(io.BytesIO(order1))]
+    assert methods[0] == CANONICAL and ORDER1 in methods
+    assert b"".join(decode_stream(io.BytesIO(order1))) == b
+
+def test_parallel_encode_matches_serial_encode():
+    b = b"A_DEAD_DAD_CEDED_A_BAD_BABE_A_BEADED_ABACA_BED" * 100
+    serial = b"".join(encode_stream(io.BytesIO(b), 1000))
+    parallel = b"".join(encode_stream(io.BytesIO(b), 1000, jobs=2))
+    assert parallel == serial
+    result = b"".join(decode_stream(io.BytesIO(parallel), jobs=2))
+    assert result == b
+
+def test_decode_block_at_seeks_via_index():
+    b = bytes(range(256)) * 10
+    comp = io.BytesIO(b"".join(encode_stream(io.BytesIO(b), 1000)))
+    index = read_index(comp)
+    assert [size for _, size in index] == [1000, 1000, 560]
+    offset, _ = index[2]
+    assert decode_block_at(comp, offset) == b[2000:]
+
+def test_decode_file_to_file_is_identity(tmp_path):
+    b = b"A_DEAD_DAD_CEDED_A_BAD_BABE_A_BEADED_ABACA_BED" * 100
+    (tmp_path / "in").write_bytes(
+        b"".join(encode_stream(io.BytesIO(b), 1000))
+    )
+    decode_file_to_file(tmp_path / "in", tmp_path / "out")
+    assert (tmp_path / "out").read_bytes() == b
+
+def test_decode_file_to_file_of_truncated_file_raises_value_error(tmp_path):
+    b = b"A_DEAD_DAD_CEDED_A_BAD_BABE_A_BEADED_ABACA_BED" * 100
+    comp = b"".join(encode_stream(io.BytesIO(b), 1000))
+    (tmp_path / "in").write_bytes(comp[:len(comp) // 2])
+    try:
+        decode_file_to_file(tmp_path / "in", tmp_path / "out")
+    except ValueError:
+        pass
+    else:
+        assert False, "truncated file was accepted"
+
+def test_decode_file_to_file_checks_block_sizes_against_index(tmp_path):
+    b = b"A_DEAD_DAD_CEDED_A_BAD_BABE_A_BEADED_ABACA_BED" * 100
+    comp = b"".join(encode_stream(io.BytesIO(b), 1000))
+    last = len(comp) - FOOTER_SIZE - 4
+    for delta in (100, -100):
+        size = bytes_to_int(comp[last:last+4]) + delta
+        (tmp_path / "in").write_bytes(comp[:last] + int_to_bytes(size) + comp[last+4:])
+        try:
+            decode_file_to_file(tmp_path / "in", tmp_path / "out")
+        except ValueError:
+            pass
+        else:
+            assert False, "index size {} was accepted".format(size)
+
 def decode(ba):
     dict_length = ba2int(ba[0:16])
     de_dict_encoded = ba[16:16+dict_length]
-    payload_length = ba2int(ba[16+dict_length:16+dict_length+64])
-    payload = ba[16+dict_length+64:16+dict_length+64+payload_length]
-    de_dict = deserialize_dict(de_dict_encoded)
+    payload = read_payload(ba, 16 + dict_length)
+    de_dict = {
+        token[0]: encoding
+        for token, encoding in deserialize_dict(de_dict_encoded).items()
+    }
     if payload:
-        return b"".join(payload.decode(de_dict))
+        return bytes(payload.decode(de_dict))
     else:
         return b""
 
+# The payload is the rest of ba after its 64-bit length at i.
+def read_payload(ba, i):
+    payload_length = ba2int(ba[i:i+64])
+    payload = ba[i+64:i+64+payload_length]
+    if len(payload) != payload_length:
+        raise ValueError("truncated payload")
+    return payload
+
 def encode(b):
     counts = collections.Counter(b)
 
@@ -91,27 +295,536 @@ def deserialize_dict(ba):
     i = 0
     while i < len(ba):
         length = ba2int(ba[i:i+8])
+        if i + 16 + length > len(ba):
+            raise ValueError("truncated code table")
         token = ba[i+8:i+16].tobytes()
         encoding = ba[i+16:i+16+length]
         result[token] = encoding
         i += 8 + 8 + length
     return result
 
-def encode_stdin():
-    data = sys.stdin.buffer.read()
-    comp = encode(data)
-    sys.stdout.buffer.write(comp)
-    sys.stdout.buffer.flush()
+def decode_canonical(ba):
+    lengths, i = deserialize_lengths(ba)
+    payload = read_payload(ba, i)
+    if not payload:
+        return b""
+    return bytes(payload.decode(decodetree(canonical_codes(lengths))))
+
+def decode_canonical_table(ba):
+    lengths, i = deserialize_lengths(ba)
+    payload = read_payload(ba, i)
+    table = build_decode_table(lengths)
+    return decode_table(payload.tobytes(), len(payload), table)
 
-def decode_stdin():
-    comp = sys.stdin.buffer.read()
-    ba = bitarray()
-    ba.frombytes(comp)
-    data = decode(ba)
-    sys.stdout.buffer.write(data)
+# Order-1 context model: a separate canonical code for the bytes that
+# follow each byte value, so a block is described by a table of the
+# contexts seen, then one code-length table per context.
+def decode_order1(ba):
+    contexts, i = deserialize_lengths(ba)
+    tables = [None] * 256
+    for context in sorted(contexts):
+        lengths, i = deserialize_lengths(ba, i)
+        tables[context] = build_decode_table(
+            lengths,
+            ORDER1_PEEK_BITS,
+            multi_symbol=False,
+        )
+    payload = read_payload(ba, i)
+    return decode_contexts(payload.tobytes(), len(payload), tables)
+
+def encode_order1(b):
+    previous = bytes(1) + b[:-1]
+    counts = collections.defaultdict(dict)
+    for (context, symbol), count in collections.Counter(zip(previous, b)).items():
+        counts[context][symbol] = count
+    header = serialize_lengths({context: 1 for context in counts})
+    codes = {}
+    for context in sorted(counts):
+        lengths = code_lengths(counts[context])
+        header += serialize_lengths(lengths)
+        for symbol, code in canonical_codes(lengths).items():
+            codes[(context, symbol)] = code
+    z = bitarray()
+    if b:
+        z.encode(codes, zip(previous, b))
+    return header + int2ba(len(z), length=64) + z
+
+def encode_canonical(b):
+    lengths = code_lengths(collections.Counter(b))
+    z = bitarray()
+    if b:
+        z.encode(canonical_codes(lengths), b)
+    return serialize_lengths(lengths) + int2ba(len(z), length=64) + z
+
+# Huffman code lengths, merging the two lightest subtrees with a heap.
+def code_lengths(counts):
+    if len(counts) == 1:
+        return {symbol: 1 for symbol in counts}
+    lengths = {symbol: 0 for symbol in counts}
+    heap = [
+        (count, symbol, [symbol])
+        for symbol, count in counts.items()
+    ]
+    heapq.heapify(heap)
+    while len(heap) > 1:
+        left_count, left_key, left = heapq.heappop(heap)
+        right_count, right_key, right = heapq.heappop(heap)
+        for symbol in left + right:
+            lengths[symbol] += 1
+        heapq.heappush(
+            heap,
+            (left_count + right_count, min(left_key, right_key), left + right),
+        )
+    return lengths
+
+# Codes of equal length are consecutive integers, ordered by symbol, so
+# the lengths alone are enough to rebuild them.
+def canonical_codes(lengths):
+    codes = {}
+    code = 0
+    previous_length = 0
+    for length, symbol in sorted(
+        (length, symbol) for symbol, length in lengths.items() if length
+    ):
+        code <<= length - previous_length
+        if code >> length:
+            raise ValueError("too many codes for lengths")
+        codes[symbol] = int2ba(code, length=length)
+        code += 1
+        previous_length = length
+    return codes
+
+# One LENGTH_BITS length per byte value; a zero length is followed by
+# the number of further zero lengths in the run.
+def serialize_lengths(lengths):
+    result = bitarray()
+    symbol = 0
+    while symbol < 256:
+        length = lengths.get(symbol, 0)
+        if length >= 1 << LENGTH_BITS:
+            raise ValueError("code length too long: {}".format(length))
+        result += int2ba(length, length=LENGTH_BITS)
+        symbol += 1
+        if length == 0:
+            run = 0
+            while (
+                symbol < 256 and
+                run < (1 << ZERO_RUN_BITS) - 1 and
+                lengths.get(symbol, 0) == 0
+            ):
+                run += 1
+                symbol += 1
+            result += int2ba(run, length=ZERO_RUN_BITS)
+    return result
+
+def deserialize_lengths(ba, i=0):
+    lengths = {}
+    symbol = 0
+    while symbol < 256:
+        length = ba2int(ba[i:i+LENGTH_BITS])
+        i += LENGTH_BITS
+        if length:
+            lengths[symbol] = length
+            symbol += 1
+        else:
+            symbol += 1 + ba2int(ba[i:i+ZERO_RUN_BITS])
+            i += ZERO_RUN_BITS
+    return lengths, i
+
+# Lookup tables for decoding peek_bits bits at a time.
+#
+# single is indexed by the next peek_bits bits and holds the symbol whose
+# code starts them, as (symbol, bits consumed). A window starting with a
+# code longer than peek_bits holds (None, 0) instead, and the code is
+# found in secondary: (length, first code, symbols) for each longer
+# length, which canonical codes make enough to decode without a table
+# that grows with the code length. (None, -1) marks bits that start no
+# code. With multi_symbol, primary holds every
+# symbol whose code lies wholly within the window, so one lookup can
+# decode several symbols; otherwise it is single.
+def build_decode_table(lengths, peek_bits=PEEK_BITS, multi_symbol=True):
+    codes = canonical_codes(lengths)
+    single = [(None, -1)] * (1 << peek_bits)
+    long_codes = {}
+    for symbol, code in codes.items():
+        length = len(code)
+        if length <= peek_bits:
+            start = ba2int(code) << (peek_bits - length)
+            entry = (symbol.to_bytes(1, byteorder='big'), length)
+            for index in range(start, start + (1 << (peek_bits - length))):
+                single[index] = entry
+        else:
+            single[ba2int(code[:peek_bits])] = (None, 0)
+            first, symbols = long_codes.setdefault(length, (ba2int(code), []))
+            symbols.append(symbol.to_bytes(1, byteorder='big'))
+
+    secondary = [
+        (length, first, symbols)
+        for length, (first, symbols) in sorted(long_codes.items())
+    ]
+
+    primary = single
+    if multi_symbol:
+        primary = list(single)
+        mask = (1 << peek_bits) - 1
+        for index in range(1 << peek_bits):
+            symbols = b""
+            consumed = 0
+            while consumed < peek_bits:
+                symbol, length = single[(index << consumed) & mask]
+                if symbol is None or consumed + length > peek_bits:
+                    break
+                symbols += symbol
+                consumed += length
+            if symbols:
+                primary[index] = (symbols, consumed)
+
+    max_length = max((len(code) for code in codes.values()), default=0)
+    return peek_bits, max_length, primary, secondary, single
+
+def decode_table(data, payload_length, table):
+    peek_bits, max_length, primary, secondary, single = table
+    mask = (1 << peek_bits) - 1
+    need = max(peek_bits, max_length)
+    data = bytes(data) + bytes(REFILL_BYTES)
+    out = bytearray()
+    acc = 0
+    acc_bits = 0
+    position = 0
+    remaining = payload_length
+
+    # Between refills the accumulator holds enough bits for every lookup
+    # down to limit, so the inner loop only indexes and shifts.
+    while remaining >= need:
+        acc, acc_bits, position = refill(data, acc, acc_bits, position)
+        start_bits = acc_bits
+        limit = max(need, acc_bits - remaining + need)
+        while acc_bits >= limit:
+            symbols, length = primary[(acc >> (acc_bits - peek_bits)) & mask]
+            if symbols is None:
+                symbols, length = lookup_long(acc, acc_bits, table, length)
+            out += symbols
+            acc_bits -= length
+        remaining -= start_bits - acc_bits
+
+    while remaining > 0:
+        if acc_bits < need:
+            acc, acc_bits, position = refill(data, acc, acc_bits, position)
+        symbol, length = single[(acc >> (acc_bits - peek_bits)) & mask]
+        if symbol is None:
+            symbol, length = lookup_long(acc, acc_bits, table, length)
+        if length > remaining:
+            raise ValueError("invalid code")
+        out += symbol
+        acc_bits -= length
+        remaining -= length
+
+    return bytes(out)
+
+# Like decode_table, one symbol at a time, with the table for each
+# symbol chosen by the symbol before it.
+def decode_contexts(data, payload_length, tables):
+    peek_bits = ORDER1_PEEK_BITS
+    mask = (1 << peek_bits) - 1
+    singles = [table and table[4] for table in tables]
+    need = max(
+        [peek_bits] + [table[1] for table in tables if table is not None]
+    )
+    data = bytes(data) + bytes(REFILL_BYTES)
+    out = bytearray()
+    acc = 0
+    acc_bits = 0
+    position = 0
+    remaining = payload_length
+    context = 0
+
+    while remaining > 0:
+        if acc_bits < need:
+            acc, acc_bits, position = refill(data, acc, acc_bits, position)
+        single = singles[context]
+        if single is None:
+            raise ValueError("invalid code")
+        symbol, length = single[(acc >> (acc_bits - peek_bits)) & mask]
+        if symbol is None:
+            symbol, length = lookup_long(acc, acc_bits, tables[context], length)
+        if length > remaining:
+            raise ValueError("invalid code")
+        out += symbol
+        acc_bits -= length
+        remaining -= length
+        context = symbol[0]
+
+    return bytes(out)
+
+def refill(data, acc, acc_bits, position):
+    acc = (
+        ((acc & ((1 << acc_bits) - 1)) << (8 * REFILL_BYTES)) |
+        int.from_bytes(data[position:position+REFILL_BYTES], byteorder='big')
+    )
+    return acc, acc_bits + 8 * REFILL_BYTES, position + REFILL_BYTES
+
+def lookup_long(acc, acc_bits, table, k):
+    _, _, _, secondary, _ = table
+    if k < 0:
+        raise ValueError("invalid code")
+    for length, first, symbols in secondary:
+        code = (acc >> (acc_bits - length)) & ((1 << length) - 1)
+        if first <= code < first + len(symbols):
+            return symbols[code - first], length
+    raise ValueError("invalid code")
+
+CODECS = {
+    TREE: (encode, decode),
+    CANONICAL: (encode_canonical, decode_canonical),
+    ORDER1: (encode_order1, decode_order1),
+}
+
+# Container: a sequence of independently encoded blocks, each prefixed
+# by the method used and its length in bytes, terminated by a zero
+# length. An index of (offset, decoded size) per block follows, then a
+# footer giving the index offset, so a seekable reader can jump straight
+# to any block.
+def encode_stream(stream, block_size=BLOCK_SIZE, method=CANONICAL, jobs=1):
+    blocks = (
+        (method, block if jobs == 1 else bytes(block))
+        for block in iter(functools.partial(stream.read, block_size), b"")
+    )
+    offset = 0
+    index = []
+    for block_method, size, comp in parallel_map(encode_block, blocks, jobs):
+        index.append((offset, size))
+        yield int_to_bytes(block_method, length=1) + int_to_bytes(len(comp))
+        yield comp
+        offset += BLOCK_HEADER_SIZE + len(comp)
+    yield int_to_bytes(method, length=1) + int_to_bytes(0)
+    offset += BLOCK_HEADER_SIZE
+    yield b"".join(
+        int_to_bytes(block_offset, length=8) + int_to_bytes(size)
+        for block_offset, size in index
+    )
+    yield int_to_bytes(offset, length=8) + INDEX_MAGIC
+
+def decode_stream(stream, jobs=1):
+    blocks = (
+        (method, comp if jobs == 1 else bytes(comp))
+        for method, comp in read_blocks(stream)
+    )
+    yield from parallel_map(decode_block, blocks, jobs)
+
+# Order-1 spends a code table per context, which on data with little
+# context to exploit costs more than it saves, so a block where it comes
+# out larger than canonical is stored as canonical. Each block records
+# its own method, so the decoder needs nothing more.
+def encode_block(method, block):
+    encoder, _ = CODECS[method]
+    comp = encoder(block).tobytes()
+    if method == ORDER1:
+        canonical = encode_canonical(block).tobytes()
+        if len(canonical) < len(comp):
+            return CANONICAL, len(block), canonical
+    return method, len(block), comp
+
+def decode_block(method, comp):
+    _, decoder = CODECS[method]
+    return decoder(bitarray(buffer=comp))
+
+def read_blocks(stream):
+    while True:
+        header = read_exactly(stream, BLOCK_HEADER_SIZE)
+        method, length = header[0], bytes_to_int(header[1:])
+        if length == 0:
+            return
+        if method not in CODECS:
+            raise ValueError("unknown method: {}".format(method))
+        yield method, read_exactly(stream, length)
+
+def read_index(stream):
+    stream.seek(-FOOTER_SIZE, io.SEEK_END)
+    footer = read_exactly(stream, FOOTER_SIZE)
+    if footer[8:] != INDEX_MAGIC:
+        raise ValueError("no block index")
+    index_offset = bytes_to_int(footer[:8])
+    index_length = stream.tell() - FOOTER_SIZE - index_offset
+    stream.seek(index_offset)
+    index = read_exactly(stream, index_length)
+    return [
+        (bytes_to_int(index[i:i+8]), bytes_to_int(index[i+8:i+12]))
+        for i in range(0, len(index), 12)
+    ]
+
+def decode_block_at(stream, offset):
+    stream.seek(offset)
+    for method, comp in read_blocks(stream):
+        return decode_block(method, comp)
+    raise ValueError("no block at offset {}".format(offset))
+
+# Like itertools.starmap, but spread over a pool of worker processes
+# with at most two tasks per worker in flight, keeping results in order.
+def parallel_map(f, items, jobs):
+    if jobs == 1:
+        yield from itertools.starmap(f, items)
+        return
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        pending = collections.deque()
+        for item in items:
+            pending.append(executor.submit(f, *item))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def int_to_bytes(n, length=4):
+    return n.to_bytes(length, byteorder='big')
+
+def bytes_to_int(b):
+    return int.from_bytes(b, byteorder='big')
+
+def read_exactly(stream, n):
+    result = stream.read(n)
+    if len(result) != n:
+        raise ValueError("truncated stream")
+    return result
+
+# File-like reads over a buffer, returning memoryview slices rather than
+# copies, so blocks of a memory-mapped file are never copied on read.
+# Pages of a mapping that have been read past are dropped from the
+# process (they stay in the page cache), keeping RSS at about one block.
+class BufferReader(object):
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+        self.position = 0
+        self.released = 0
+
+    def read(self, n):
+        if isinstance(self.buffer, mmap.mmap):
+            self.released = release_pages(self.buffer, self.released, self.position)
+        result = self.view[self.position:self.position+n]
+        self.position += len(result)
+        return result
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        self.position = offset
+        self.released = min(self.released, offset - offset % mmap.PAGESIZE)
+        return offset
+
+    def tell(self):
+        return self.position
+
+# Drops whole pages of m between start and end from this process.
+def release_pages(m, start, end):
+    end -= end % mmap.PAGESIZE
+    if end > start:
+        m.madvise(mmap.MADV_DONTNEED, start, end - start)
+        return end
+    return start
+
+@contextlib.contextmanager
+def mapped(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield BufferReader(b"")
+            return
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        reader = BufferReader(m)
+        # If decoding fails, its traceback still holds slices of the map,
+        # and closing it would raise BufferError in place of the error.
+        # It is left to be unmapped once they are freed instead.
+        yield reader
+        reader.view.release()
+        m.close()
+
+# The index gives the decoded size up front, so the output file is
+# allocated once and each block is decoded straight into its place.
+# Each block is checked against its size in the index before it is
+# written, so a bad index is a ValueError rather than a padded file.
+def decode_file_to_file(path, output_path, jobs=1):
+    with mapped(path) as stream:
+        sizes = [block_size for _, block_size in read_index(stream)]
+        size = sum(sizes)
+        stream.seek(0)
+        with open(output_path, "w+b") as out:
+            out.truncate(size)
+            if size == 0:
+                if any(decode_stream(stream, jobs)):
+                    raise ValueError("decoded size does not match the index")
+                return
+            with mmap.mmap(out.fileno(), size) as m:
+                position = 0
+                released = 0
+                blocks = iter(sizes)
+                for data in decode_stream(stream, jobs):
+                    if len(data) != next(blocks, None):
+                        raise ValueError("block size does not match the index")
+                    m[position:position+len(data)] = data
+                    position += len(data)
+                    released = release_pages(m, released, position)
+                if position != size:
+                    raise ValueError("decoded size does not match the index")
+
+def make_parser():
+    parser = argparse.ArgumentParser(epilog="main.py bench --help for benchmarks")
+    parser.add_argument("command", choices=["encode", "decode"])
+    parser.add_argument(
+        "path",
+        nargs="?",
+        help="memory-map this file instead of reading stdin",
+    )
+    parser.add_argument("-o", "--output", help="write here instead of stdout")
+    parser.add_argument(
+        "--method",
+        choices=sorted(METHOD_NAMES),
+        default="canonical",
+    )
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument(
+        "--block",
+        type=int,
+        help="decode only this block, counting from 0 (needs seekable input)",
+    )
+    return parser
+
+def main(argv):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if args.command == "decode" and args.path and args.output and args.block is None:
+        decode_file_to_file(args.path, args.output, args.jobs)
+        return
+    with contextlib.ExitStack() as stack:
+        stream = (
+            stack.enter_context(mapped(args.path))
+            if args.path
+            else sys.stdin.buffer
+        )
+        out = (
+            stack.enter_context(open(args.output, "wb"))
+            if args.output
+            else sys.stdout.buffer
+        )
+        if args.command == "encode":
+            method = METHOD_NAMES[args.method]
+            chunks = encode_stream(stream, method=method, jobs=args.jobs)
+        elif args.block is None:
+            chunks = decode_stream(stream, args.jobs)
+        else:
+            index = read_index(stream)
+            if not 0 <= args.block < len(index):
+                parser.error("--block {} is out of range: the input has {} blocks".format(
+                    args.block, len(index),
+                ))
+            offset, _ = index[args.block]
+            chunks = [decode_block_at(stream, offset)]
+        for chunk in chunks:
+            out.write(chunk)
+        out.flush()
 
 if __name__ == "__main__":
-    if sys.argv[1] == "encode":
-        encode_stdin()
-    elif sys.argv[1] == "decode":
-        decode_stdin()
+    if sys.argv[1:2] == ["bench"]:
+        import bench
+        bench.run(sys.argv[2:])
+    else:
+        main(sys.argv[1:])